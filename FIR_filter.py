@@ -1,64 +1,191 @@
 #!/usr/bin/env python3
 
 """
-v0.1
-Script para combinar dos filtros FIR en formato '.pcm' 32 bits.
+v0.3
+Script para combinar filtros FIR en formato '.pcm' 32 bits.
 
-Mediante convolución obtenemos el FIR resultado.
+Mediante convolución obtenemos el FIR resultado de la cadena de filtros
+proporcionados (p.ej. crossover + eq de sala + eq del driver).
 
 Uso:
 
-    FIR_filter.py   path/to/fir_1.pcm   path/to/fir_2.pcm
+    FIR_filter.py   path/to/fir_1.pcm   path/to/fir_2.pcm  [fir_3.pcm ...]  [opciones]
+
+    -full           Guarda el FIR resultante completo (suma de longitudes - N + 1)
+
+    -tM             Guarda las primeras M muestras con semiventana Blackman-Harris,
+                    por defecto M es la longitud del FIR más largo.
+
+    -o=file.pcm     Archivo de salida, por defecto 'fir_1+fir_2+...pcm'
+
+Modo batch (varias cadenas en paralelo):
+
+    -jobs=file.txt  Lista de trabajos, una cadena por línea con la misma sintaxis
+                    de archivos y -o= de la línea de comandos ('#' comentarios).
+                    Las rutas relativas lo son a la carpeta de 'file.txt'.
+
+    -glob=PATTERN   Un trabajo por cada pcm que case con PATTERN (admite '**'),
+                    encadenado con los demás pcm dados en la línea de comandos.
+                    p.ej:  -glob='*/44100/xo_*.pcm'  roomeq.pcm
+
+    -jN             N procesos en paralelo, por defecto tantos como CPUs.
 
 """
+# v0.2
+#   - Convolución en el dominio rfft en lugar de signal.lfilter, admite N FIRs.
+#   - Opciones -full, -tM y -o=
+# v0.3
+#   - Modo batch -jobs= / -glob= con un pool de procesos -jN
+#   - Escritura atómica de los pcm (tools.savePCM32)
 
 # (i) Como es de esperar, el resultado es el mismo si cambiamos el
 #     orden de los pcm proporcionados. La convolución es conmutativa.
 
-# https://scipy-cookbook.readthedocs.io/items/ApplyFIRFilter.html
-
-# From scipy.signal, lfilter() is designed to apply a discrete IIR filter to a signal,
-# so by simply setting the array of denominator coefficients to [1.0],
-# it can be used to apply a FIR filter.
-
-# signal.lfilter is designed to filter one-dimensional data. It can take a two-dimensional
-# array (or, in general, an n-dimensional array) and filter the data in any given axis.
-# It can also be used for IIR filters, so in our case, we'll pass in [1.0] for the
-# denominator coefficients. In python, this looks like:
-# y = lfilter(b, [1.0], x)
-#
-# To obtain exactly the same array as computed by convolve or fftconvolve (i.e. to get
-# the equivalent of the 'valid' mode), we must discard the beginning of the array computed
-# by lfilter. We can do this by slicing the array immediately after the call to filter:
-# y = lfilter(b, [1.0], x)[:, len(b) - 1:]
-
-import numpy as np
-from scipy import signal
+# (i) signal.lfilter(y, [1.0], x) es una convolución directa O(N·M), con dos
+#     FIR de 64 Ktaps tarda minutos. tools.convolve_firs multiplica los espectros
+#     de todos los FIR en una única rejilla rfft y vuelve con una irfft.
+
 import sys
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
 import tools
-import pydsd
 
-try:
-    xfile = sys.argv[1]
-    yfile = sys.argv[2]
-    #zfile = "result.pcm"
-    zfile = xfile.replace('.pcm','') + '+' + yfile.replace('.pcm','') + '.pcm'
-except:
-    print (__doc__)
-    sys.exit()
 
+def default_name(firfiles):
+    """ 'fir_1+fir_2+...pcm' en la carpeta del primer FIR
+    """
+    names = [ os.path.basename(f).replace('.pcm', '') for f in firfiles ]
+    return os.path.join( os.path.dirname(firfiles[0]), '+'.join(names) + '.pcm' )
+
+
+def filter_job(firfiles, zfile, mode='trunc', m=None):
+    """ convoluciona una cadena de pcm y guarda el resultado en 'zfile'
+    """
+    # Los FIR se leen como memmap, los procesos no se pasan los datos
+    firs = [ tools.readPCM32(f) for f in firfiles ]
+    z = tools.convolve_firs(firs, mode=mode, m=m)
+    tools.savePCM32(z, zfile)
+    return f'saved: {zfile} ({len(z)} taps)'
+
+
+def read_jobs(fname):
+    """ lista de trabajos (firfiles, zfile) desde un archivo de texto
+    """
+    folder = os.path.dirname(fname)
+    jobs = []
+    with open(fname) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            firfiles = [ os.path.join(folder, x) for x in line if not x.startswith('-o=') ]
+            zfiles   = [ os.path.join(folder, x[3:]) for x in line if x.startswith('-o=') ]
+            jobs.append( (firfiles, zfiles[0] if zfiles else default_name(firfiles)) )
+    return jobs
+
+
+def lee_opciones():
+
+    global firfiles, mode, m, zfile, jobsfile, pattern, nproc
+
+    firfiles = []
+    mode     = 'trunc'
+    m        = None
+    zfile    = ''
+    jobsfile = ''
+    pattern  = ''
+    nproc    = os.cpu_count()
+
+    for opc in sys.argv[1:]:
+
+        if opc in ('-h', '-help', '--help'):
+            print (__doc__)
+            sys.exit()
+
+        elif opc == '-full':
+            mode = 'full'
+
+        elif opc.startswith('-t') and opc[2:].isdigit():
+            mode = 'trunc'
+            m = int(opc[2:])
+
+        elif opc.startswith('-o='):
+            zfile = opc[3:]
+
+        elif opc.startswith('-jobs='):
+            jobsfile = opc[6:]
+
+        elif opc.startswith('-glob='):
+            pattern = opc[6:]
+
+        elif opc.startswith('-j') and opc[2:].isdigit():
+            nproc = max(1, int(opc[2:]))
+
+        elif opc[-4:] == '.pcm':
+            firfiles.append(opc)
+
+        else:
+            print( f'(!) bad option: {opc}' )
+            sys.exit()
+
+    if not (jobsfile or pattern) and len(firfiles) < 2:
+        print (__doc__)
+        sys.exit()
+
+    if firfiles and not zfile:
+        zfile = default_name(firfiles)
+
+
+def run_jobs(jobs):
+
+    errors = 0
+
+    def report(result, zfile):
+        nonlocal errors
+        try:
+            print( result() )
+        except Exception as e:
+            print( f'(!) {zfile}: {e}' )
+            errors += 1
+
+    if nproc == 1 or len(jobs) == 1:
+        for firfiles, zfile in jobs:
+            report( lambda: filter_job(firfiles, zfile, mode, m), zfile )
+
+    else:
+        with ProcessPoolExecutor(max_workers=nproc) as pool:
+            futures = [ ( pool.submit(filter_job, firfiles, zfile, mode, m), zfile )
+                        for firfiles, zfile in jobs ]
+            for future, zfile in futures:
+                report( future.result, zfile )
+
+    if errors:
+        print( f'(!) {errors} of {len(jobs)} jobs failed' )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    lee_opciones()
+
+    if jobsfile:
+        jobs = read_jobs(jobsfile)
 
-# Leemos los FIR desde los archivos
-x = tools.readPCM32(xfile)
-y = tools.readPCM32(yfile)
+    elif pattern:
+        jobs = []
+        for f in sorted( glob.glob(pattern, recursive=True) ):
+            # no encadenamos un archivo consigo mismo ni con resultados previos
+            if f in firfiles or '+' in os.path.basename(f):
+                continue
+            chain = [f] + firfiles
+            jobs.append( (chain, default_name(chain)) )
 
-# Ventana que aplicaremos
-m = max([len(x), len(y)])
-w = pydsd.semiblackmanharris(m)
+    else:
+        jobs = [ (firfiles, zfile) ]
 
-# Filtramos (aplicando ventana)
-z = w * signal.lfilter(y, [1.0], x)#[:, len(x) - 1:] # este slice no lo entiendo
+    if not jobs:
+        print( '(!) no jobs found' )
+        sys.exit()
 
-# Guardamos el resultado en el archivo de salida
-tools.savePCM32(z, zfile)
-print( f'saved: {zfile}' )
+    run_jobs(jobs)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-    v0.1c
+    v0.3b
 
     Recorta un FIR .pcm float32 o .wav int16
     El recorte se efectúa aplicando Blackmann-Harris
@@ -8,9 +8,18 @@
 
     Uso y opciones:
 
-      FIR_trim.py  file.pcm[.wav] -tM [-pP] [-asym[R]] [-o] [-lp|-mp]
+      FIR_trim.py  file.pcm[.wav] [file2.pcm ...] -tM [-tM2 ...] [-pP] [-asym[R] ...]
+                   [-o] [-lp|-mp] [-jN]
+
+      FIR_trim.py  file.pcm[.wav] [file2.pcm ...] -auto [-edc=E] [-err=D] [...]
 
       -tM       M taps de salida potencia de 2 (sin espacios)
+                Admite varios tamaños: -t8192 -t16384  o  -t8192,16384,32768
+
+      -auto     Elige M automáticamente: la menor potencia de 2 cuya energía
+                residual fuera de la ventana (curva de Schroeder) queda por
+                debajo de -edc=E dB (-60 por defecto) y cuya magnitud difiere
+                de la del FIR de entrada menos de -err=D dB (0.5 por defecto)
 
       -lp       Equivale a enventanado simétrico en el peak (autolocalizado),
                 o sea, a no poner más opciones que los taps de salida.
@@ -25,9 +34,14 @@
                 R es el ratio % que ocupará la semiventana de la izquierda.
                 Si se omite R se aplicará un ratio del 0.1 %
                 Si se omite -asym[R] se aplicará enventanado simétrico.
+                Admite varios ratios: -asym0.1 -asym1  o  -asym0.1,1
 
-      -o        Sobreescribe el archivo original.
+      -o        Sobreescribe el archivo original (solo con una única salida).
                 Si se omite se le añade un prefijo 'Mtaps_'
+                y con varios ratios el sufijo '_asymR'
+
+      -jN       N archivos de entrada procesados en paralelo,
+                por defecto tantos como CPUs.
 
     Notas de aplicación:
 
@@ -47,24 +61,56 @@
 #   Ratio ajustable para la semiventana por la izq del pico vs el ancho total (wizq+wder)
 # v0.1c
 #   Python3
+# v0.2
+#   Varios tamaños -t y ratios -asym en una sola lectura (un solo
+#   buscado del peak, ventanas cacheadas), varios archivos en paralelo -jN
+# v0.3
+#   Opción -auto, longitud mínima según la curva de decaimiento de energía
+# v0.3b
+#   Búsqueda del peak y energías por bloques sobre el memmap (tools.chunked_*)
 
 import sys
+import os
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pydsd as dsd
 import tools
 
+# -auto: longitud mínima a probar, y rango bajo el máximo de la magnitud
+# donde se evalúa el error (por debajo el error en dB no es significativo)
+AUTO_MIN_TAPS = 512
+AUTO_ERR_RANGE = 60.0
+
+
+@lru_cache(maxsize=32)
+def window(kind, m):
+    """ ventanas de recorte, se reusan entre salidas y archivos
+    """
+    if kind == 'semi':
+        w = dsd.semiblackmanharris(m)
+    else:
+        w = dsd.blackmanharris(m)
+    w.flags.writeable = False
+    return w
+
+
 def lee_opciones():
 
-    global f_in, f_out, m, phasetype
-    global pkPos, sym, wratio, overwriteFile
+    global f_ins, sizes, wratios, pkPos, sym, overwriteFile, nproc
+    global auto, edc_dB, err_dB
 
-    f_in = ''
-    m = 0
+    f_ins = []
+    sizes = []
+    wratios = []
     phaseType= ''
     pkPos = -1 # fuerza la búsqueda del peak
     overwriteFile = False
     sym = True
-    wratio = 0.001
+    nproc = os.cpu_count()
+    auto = False
+    edc_dB = -60.0
+    err_dB = 0.5
 
     if len(sys.argv) == 1:
         print (__doc__)
@@ -73,11 +119,13 @@ def lee_opciones():
     for opc in sys.argv[1:]:
 
         if opc.startswith('-t'):
-            m = int(opc.replace('-t', ''))
-            if not tools.isPowerOf2(m):
-                print (__doc__)
-                print( f'    {m} is not power of 2\n' )
-                sys.exit()
+            for x in opc[2:].split(','):
+                m = int(x)
+                if not tools.isPowerOf2(m):
+                    print (__doc__)
+                    print( f'    {m} is not power of 2\n' )
+                    sys.exit()
+                sizes.append(m)
 
         elif opc.startswith('-p'):
             pkPos = int(opc.replace('-p', ''))
@@ -92,8 +140,7 @@ def lee_opciones():
         elif opc.startswith('-asym'):
             sym = False
             if opc[5:]:
-                wpercent = float(opc[5:])
-                wratio = wpercent / 100.0
+                wratios += [ float(x) / 100.0 for x in opc[5:].split(',') ]
 
         elif opc == '-lp':
             phaseType = 'lp'
@@ -101,14 +148,29 @@ def lee_opciones():
         elif opc == '-mp':
             phaseType = 'mp'
 
+        elif opc.startswith('-j') and opc[2:].isdigit():
+            nproc = max(1, int(opc[2:]))
+
+        elif opc == '-auto':
+            auto = True
+
+        elif opc.startswith('-edc='):
+            edc_dB = -abs(float(opc[5:]))
+
+        elif opc.startswith('-err='):
+            err_dB = abs(float(opc[5:]))
+
         else:
-            if not f_in:
-                f_in = opc
+            f_ins.append(opc)
 
-    if not m:
+    if not (sizes or auto) or not f_ins:
         print (__doc__)
         sys.exit()
 
+    if auto and sizes:
+        print( '(!) use either -tM or -auto' )
+        sys.exit()
+
     if phaseType == 'lp':
         sym = True
         pkPos = -1 # pkPos autodiscovered
@@ -116,32 +178,83 @@ def lee_opciones():
         sym = False
         pkPos = 0
 
+    if sym or not wratios:
+        wratios = [0.001]
 
-    # El nombre de archivo de salida depende de si se pide sobreescribir
-    if not overwriteFile:
-        f_out = str(m) + "taps_" + f_in.replace('.wav', '.pcm')
-    else:
-        f_out = f_in.replace('.wav', '.pcm')
-
+    sizes   = sorted(set(sizes))
+    wratios = list(dict.fromkeys(wratios))
 
-if __name__ == "__main__":
+    if overwriteFile and max(len(sizes), auto) * len(wratios) * len(f_ins) > 1:
+        print( '(!) -o only with a single input file and a single output' )
+        sys.exit()
 
-    # Leemos opciones
-    lee_opciones()
 
-    # Leemos el impulso de entrada imp1
-    if   f_in[-4:] == '.pcm':
-        imp1 = tools.readPCM32(f_in)
-    elif f_in[-4:] == '.wav':
-        fs, imp1 = tools.readWAV(f_in)
-    else:
-        print( f'(i) trimFIR.py \'{f_in}\' no se reconoce :-/' )
-        sys.exit()
+def out_name(f_in, m, wratio, overwrite=False, suffix=False):
+    """ El nombre de archivo de salida depende de si se pide sobreescribir
+    """
+    if overwrite:
+        return f_in.replace('.wav', '.pcm')
+    folder, fname = os.path.split( f_in.replace('.wav', '.pcm') )
+    if suffix:
+        fname = fname.replace('.pcm', f'_asym{100 * wratio:g}.pcm')
+    return os.path.join(folder, str(m) + "taps_" + fname)
 
-    # Buscamos el pico si no se ha indicado una posición predefinida:
-    if pkPos == -1:
-        pkPos = abs(imp1).argmax()
 
+def span(pkPos, m, sym, wratio):
+    """ tramo [start, stop) del FIR de entrada que conserva trim()
+    """
+    if not sym:
+        nleft = int(wratio * m)
+        start = pkPos - nleft if nleft <= pkPos else 0
+        return start, start + m
+    return int(pkPos-m/2), int(pkPos+m/2)
+
+
+def schroeder(imp, n):
+    """ Curva de decaimiento de energía (integración inversa de Schroeder)
+        en la muestra 'n': edc(n) = sum(imp[n:]**2)
+
+        (i) Solo se necesita en los extremos de cada tramo candidato,
+            se integra por bloques sobre el memmap sin la curva completa.
+    """
+    return tools.chunked_energy(imp[n:])
+
+
+def auto_length(imp1, pkPos, sym, wratio, edc_dB=-60.0, err_dB=0.5):
+    """ La menor potencia de 2 que cumple los umbrales de energía residual
+        y de error de magnitud, o None si ninguna menor que la entrada.
+
+        Devuelve (m, residual dB, error dB)
+    """
+    N     = len(imp1)
+    total = schroeder(imp1, 0)
+
+    # Magnitud de referencia en la rejilla de la entrada completa
+    ref  = 20 * np.log10( np.abs(np.fft.rfft(imp1)) + 1e-20 )
+    band = ref > ref.max() - AUTO_ERR_RANGE
+
+    m = AUTO_MIN_TAPS
+    while m < N:
+        start, stop = span(pkPos, m, sym, wratio)
+        if start < 0 or stop > N:
+            break
+        # energía fuera del tramo conservado
+        residual = ( total - schroeder(imp1, start) + schroeder(imp1, stop) ) / total
+        residual_dB = 10 * np.log10( max(residual, 1e-30) )
+        if residual_dB <= edc_dB:
+            mag = 20 * np.log10( np.abs(np.fft.rfft(trim(imp1, pkPos, m, sym, wratio), N))
+                                 + 1e-20 )
+            error_dB = np.max( np.abs(mag - ref)[band] )
+            if error_dB <= err_dB:
+                return m, residual_dB, error_dB
+        m *= 2
+
+    return None, None, None
+
+
+def trim(imp1, pkPos, m, sym, wratio):
+    """ recorta 'imp1' a 'm' taps enventanando respecto a pkPos
+    """
     # Enventanado NO simétrico
     if not sym:
         # Hacemos dos semiventanas, una muy corta por delante para pillar bien el impulso
@@ -149,20 +262,79 @@ if __name__ == "__main__":
         nleft  = int(wratio * m)
         if nleft <= pkPos:
             nright = m - nleft
-            imp2L = imp1[pkPos-nleft:pkPos]  * dsd.semiblackmanharris(nleft)[::-1]
-            imp2R = imp1[pkPos:pkPos+nright] * dsd.semiblackmanharris(nright)
-            imp2 = np.concatenate([imp2L, imp2R])
+            imp2L = imp1[pkPos-nleft:pkPos]  * window('semi', nleft)[::-1]
+            imp2R = imp1[pkPos:pkPos+nright] * window('semi', nright)
+            return np.concatenate([imp2L, imp2R])
         else:
-            imp2 = imp1[0:m] * dsd.semiblackmanharris(m)
+            return imp1[0:m] * window('semi', m)
 
     # Enventanado simétrico
     else:
         # Aplicamos la ventana centrada en el pico
-        imp2 = imp1[int(pkPos-m/2) : int(pkPos+m/2)] * dsd.blackmanharris(m)
+        return imp1[int(pkPos-m/2) : int(pkPos+m/2)] * window('full', m)
+
+
+def trim_file(f_in, sizes, wratios, pkPos=-1, sym=True, overwrite=False,
+              auto=False, edc_dB=-60.0, err_dB=0.5):
+    """ lee un FIR y guarda todas las variantes pedidas, devuelve el informe
+    """
+    # Leemos el impulso de entrada imp1
+    if   f_in[-4:] == '.pcm':
+        imp1 = tools.readPCM32(f_in)
+    elif f_in[-4:] == '.wav':
+        fs, imp1 = tools.readWAV(f_in)
+    else:
+        return f'(i) FIR_trim.py \'{f_in}\' no se reconoce :-/'
+
+    # Buscamos el pico (una sola vez) si no se ha indicado una posición predefinida:
+    pk = tools.chunked_peak(imp1) if pkPos == -1 else pkPos
+
+    report = []
+    variants = [ (m, wratio) for m in sizes for wratio in wratios ]
+
+    if auto:
+        variants = []
+        for wratio in wratios:
+            m, residual_dB, error_dB = auto_length(imp1, pk, sym, wratio, edc_dB, err_dB)
+            if m is None:
+                report.append( f'(i) {f_in}: no power of 2 shorter than {len(imp1)} taps '
+                               f'meets edc {edc_dB:g} dB, err {err_dB:g} dB' )
+                continue
+            # el coste del convolver es proporcional a la longitud del FIR
+            saving = 100 * (1 - m / len(imp1))
+            report.append( f'{f_in}: auto {m} taps (residual {residual_dB:.1f} dB, '
+                           f'max err {error_dB:.2f} dB), '
+                           f'CPU saving {saving:.0f}% vs {len(imp1)} taps' )
+            variants.append( (m, wratio) )
+
+    for m, wratio in variants:
+        imp2 = trim(imp1, pk, m, sym, wratio)
+        # Informativo
+        pkPos2 = abs(imp2).argmax()
+        # Y lo guardamos en formato pcm float 32
+        f_out = out_name(f_in, m, wratio, overwrite, len(wratios) > 1)
+        tools.savePCM32(imp2, f_out)
+        report.append( f'FIR recortado en: {f_out} (peak: {str(pk)}, peak_{str(m)}: {str(pkPos2)})' )
+
+    return '\n'.join(report)
 
-    # Informativo
-    pkPos2 = abs(imp2).argmax()
 
-    # Y lo guardamos en formato pcm float 32
-    tools.savePCM32(imp2, f_out)
-    print( f'FIR recortado en: {f_out} (peak: {str(pkPos)}, peak_{str(m)}: {str(pkPos2)})' )
+if __name__ == "__main__":
+
+    # Leemos opciones
+    lee_opciones()
+
+    opts = (sizes, wratios, pkPos, sym, overwriteFile, auto, edc_dB, err_dB)
+
+    if nproc == 1 or len(f_ins) == 1:
+        for f_in in f_ins:
+            print( trim_file(f_in, *opts) )
+
+    else:
+        with ProcessPoolExecutor(max_workers=nproc) as pool:
+            futures = [ (pool.submit(trim_file, f_in, *opts), f_in) for f_in in f_ins ]
+            for future, f_in in futures:
+                try:
+                    print( future.result() )
+                except Exception as e:
+                    print( f'(!) {f_in}: {e}' )
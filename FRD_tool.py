@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 """
-    v0.5
+    v0.5e
     Visor de archivos de respuesta en frecuencia .frd .txt
 
     Uso:
@@ -30,6 +30,13 @@
     -f0=xx          Frecuencia en la que deja de suavizar 1/N oct
                     hasta alcanzar 1/1 oct en Nyquist
 
+    -rect           Suaviza con ventana rectangular (estilo REW / ARTA)
+                    en lugar de gaussiana
+
+    -erb            Suaviza a 1/N ERB (ancho de banda rectangular equivalente
+                    del oído, Glasberg & Moore) en lugar de 1/N oct
+    -bark           Suaviza a 1/N banda crítica (Zwicker) en lugar de 1/N oct
+
     -saveNoct       Guarda la curva suavizada en un archivo 'fileX_Noct.frd'
 
 """
@@ -48,16 +55,27 @@
 #   - muestra los offset aplicados para la opción '-autobal'
 # v0.5
 #   - Python 2 --> 3
+# v0.5b
+#   - Opción '-rect' de suavizado con ventana rectangular
+# v0.5c
+#   - Opciones '-erb' y '-bark' de suavizado psicoacústico
+# v0.5d
+#   - Interpolación con planes precalculados (interp_plan)
+# v0.5e
+#   - Las curvas se pintan con plot_reducer (envolvente min/max a la
+#     resolución de pantalla, se recalcula al hacer zoom)
 
 import sys
 import numpy as np
-from scipy import signal, interpolate
+from scipy import signal
 from scipy.stats import mode
 from matplotlib import pyplot as plt
 from matplotlib import gridspec
 from matplotlib.ticker import EngFormatter
 import tools
-from smoothSpectrum import smoothSpectrum as smooth
+from interp_plan import get_plan
+from plot_reducer import plot_reduced
+from smoothSpectrum import smoothSpectrum as smooth, set_cache_dir
 
 
 def prepara_eje_frecuencias(ax):
@@ -116,8 +134,8 @@ def BPavg(curve):
     """ Estimación del promedio de una curva de magnitudes dB en la banda de paso
     """
     # Suponemos que la curva es de tipo band-pass maomeno plana
-    # En todo caso la suavizamos para aplanarla.
-    smoothed = smooth(freq, curve, Noct=3)
+    # En todo caso la suavizamos para aplanarla (basta una ventana rectangular).
+    smoothed = smooth(freq, curve, Noct=3, window="rect")
 
     # Elegimos los bins que distan poco del máximo de la curva suavizada 1/1oct
     bandpass_locations = np.where( curve > max(smoothed) - 12)
@@ -139,7 +157,7 @@ def limpia(curva, curvaRef, th):
 
 def lee_command_line():
     global frdnames, fmin, fmax, dBrange, dBtop, subplotPha, saveNoct
-    global autobalance, normalize, maskPhaseIfLow, Noct, f0
+    global autobalance, normalize, maskPhaseIfLow, Noct, f0, window, scale
 
     frdnames = []
 
@@ -185,6 +203,12 @@ def lee_command_line():
             elif opc[:4] == '-f0=':
                 f0 = int(opc[4:])
 
+            elif opc == '-rect':
+                window = 'rect'
+
+            elif opc in ('-erb', '-bark'):
+                scale = opc[1:]
+
             elif opc[:5] == '-save':
                 saveNoct = True
 
@@ -215,6 +239,8 @@ if __name__ == "__main__":
     Noct                = 0         # Sin suavizado
     f0                  = None      # f0 para transicion del suavizado hasta 1/1 oct en Nyq
     saveNoct            = False     # guarda una versión de la curva suavizada.
+    window              = 'gauss'   # ventana de suavizado 'gauss' o 'rect'
+    scale               = 'oct'     # ancho de banda 1/N 'oct', 'erb' o 'bark'
 
     # Umbral dB de descarte para pintar la fase
     magThr = -40.0
@@ -222,6 +248,9 @@ if __name__ == "__main__":
     # Lee archivos .frd y limites de frecuencias
     lee_command_line()
 
+    # Los kernels de suavizado se guardan en disco para siguientes ejecuciones
+    set_cache_dir()
+
     # Prepara graficas
     axMag, axPha = prepara_graf()
 
@@ -253,12 +282,13 @@ if __name__ == "__main__":
         freq0 = frd[:, 0]
         mag0  = frd[:, 1]
 
-        # Funcion de interpolación con los datos leidos. (!) OjO 'cubic' puede fallar.
-        Imag = interpolate.interp1d(freq0, mag0, kind='linear',
-                                    bounds_error=False, fill_value='extrapolate')
+        # Plan de interpolación lineal (extrapolando) de las frecuencias leidas
+        # a nuestro eje 'freq', se reusa para la phase y para otros archivos
+        # con las mismas frecuencias.
+        Imag = get_plan(freq0, freq, "extrap")
 
         # Hallamos la interpolación proyectada sobre nuestro eje 'freq'
-        mag = Imag(freq)
+        mag = Imag.apply(mag0)
         BPavg_mag = round(BPavg(mag), 2)
         BPavgs.append( BPavg_mag )
 
@@ -274,17 +304,18 @@ if __name__ == "__main__":
 
         # Plot de la magnitud
         if not Noct:
-            axMag.plot(freq, mag, label=curvename)
+            plot_reduced(axMag, freq, mag, label=curvename)
         else:
             if f0:
-                smoothed = smooth(freq, mag, Noct=Noct, f0=f0)
+                smoothed = smooth(freq, mag, Noct=Noct, f0=f0, window=window,
+                                  scale=scale)
             else:
-                smoothed = smooth(freq, mag, Noct=Noct)
+                smoothed = smooth(freq, mag, Noct=Noct, window=window, scale=scale)
             # Ploteo
-            axMag.plot(freq, smoothed, label=curvename)
+            plot_reduced(axMag, freq, smoothed, label=curvename)
             # Opcionalmente guarda la versión suavizada:
             if saveNoct:
-                tools.saveFRD(curvename + '_' + str(Noct) + 'oct.frd',
+                tools.saveFRD(curvename + '_' + str(Noct) + scale + '.frd',
                               freq, smoothed, fs=None)
 
         color = axMag.lines[-1].get_color() # anotamos el color
@@ -302,14 +333,13 @@ if __name__ == "__main__":
 
                 # La interpolamos sobre nuestro vector de frecuencias
                 pha0  = frd[:, 2]
-                Ipha = interpolate.interp1d(freq0, pha0, kind="linear", bounds_error=False)
-                pha = Ipha(freq)
+                pha = get_plan(freq0, freq, "linear").apply(pha0)
                 # Limpieza opcional dejamos de pintar la phase si la amplitud es muy baja.
                 if maskPhaseIfLow:
                     pha = limpia(curva=pha, curvaRef=mag, th=magThr)
 
                 # Plot de la phase
-                axPha.plot(freq, pha, "-", linewidth=1.0, color=color)
+                plot_reduced(axPha, freq, pha, "-", linewidth=1.0, color=color)
 
 
     # Encuadre vertical.
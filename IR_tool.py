@@ -31,6 +31,21 @@
 
     -pha            Muestra la fase (experimental)
 
+    Modo batch sin gráficas (no importa matplotlib):
+
+    --no-plot       Analiza los impulsos y guarda los resultados (archivo, taps,
+                    pk offset, GD avg, linear phase, máximo de magnitud)
+
+    -out=file       Archivo de resultados .json (por defecto) o .csv
+
+    -curves=file    Guarda además las curvas (freqs, magdB, phase, gd) de cada
+                    impulso en un archivo .npz
+
+    -frd            Guarda además la respuesta de cada impulso (magnitud y phase)
+                    en un archivo 'file.frd'
+
+    -jN             N impulsos analizados en paralelo, por defecto tantos como CPUs
+
 """
 # version = 'v0.2c'
 #   Opcion -pha oculta para pintar la phase (WORK IN PROGRESS)
@@ -64,15 +79,32 @@
 #       - En filtros no lin-pha veremos una curva clara
 #       - Se informa si el filtro es lin-pha (simétrico respecto del pico)
 #
-version = 'v0.2k'
+# version = 'v0.2k'
 #   lee PIR de ARTA
+#
+# version = 'v0.2l'
+#   Búsqueda del pico y comprobación linear phase por bloques (tools.chunked_*),
+#   sin temporales del tamaño del impulso en IRs grandes (memmap)
+#
+# version = 'v0.3'
+#   Modo batch --no-plot con resultados en JSON/CSV/npz y un pool de procesos,
+#   el análisis de cada impulso se separa del ploteo (analiza_IR),
+#   matplotlib solo se importa si se va a plotear.
+#
+# version = 'v0.3b'
+#   Magnitud, phase y GD con una única rfft (tools.rfft_response) en lugar de
+#   signal.freqz + signal.group_delay. Opción -frd en el modo batch.
+#
+version = 'v0.3c'
+#   Las curvas y los impulsos se pintan reducidos a la resolución de pantalla
+#   (envolvente min/max) y se recalculan al hacer zoom (plot_reducer)
 
 import sys
+import os
+import json
+import csv
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np, math
-from scipy import signal
-from matplotlib import pyplot as plt
-from matplotlib.ticker import EngFormatter
-from matplotlib import gridspec             # customize subplots array
 import tools
 
 
@@ -80,12 +112,16 @@ def lee_commandline(opcs):
 
     global fmin, fmax, plotPha, dBtop, dBrange, lp_tolerance
     global plotIRsInOneRow, generaPDF
+    global noPlot, outName, curvesName, saveFRD, nproc, fnames, fs
 
     plotIRsInOneRow = False
     generaPDF = False
+    noPlot = False
+    outName = 'IR_tool.json'
+    curvesName = ''
+    saveFRD = False
+    nproc = os.cpu_count()
 
-    # impulsos que devolverá esta función
-    IRs = []
     # archivos que leeremos
     fnames = []
     fs = 0
@@ -126,6 +162,21 @@ def lee_commandline(opcs):
         elif opc == "-pdf":
             generaPDF = True
 
+        elif opc in ("--no-plot", "-noplot"):
+            noPlot = True
+
+        elif opc[:5] == "-out=":
+            outName = opc[5:]
+
+        elif opc[:8] == "-curves=":
+            curvesName = opc[8:]
+
+        elif opc == "-frd":
+            saveFRD = True
+
+        elif opc[:2] == "-j" and opc[2:].isdigit():
+            nproc = max(1, int(opc[2:]))
+
         else:
             fnames.append(opc)
 
@@ -134,35 +185,32 @@ def lee_commandline(opcs):
         print (__doc__)
         sys.exit()
 
-    for fname in fnames:
+    # los impulsos raw necesitan la FS
+    if not fs and not all( [ f.endswith(('.wav', '.pir')) for f in fnames ] ):
+        print (__doc__)
+        sys.exit()
 
-        if fname.endswith('.wav'):
-            fswav, imp = tools.readWAV(fname)
-            IRs.append( (fswav, imp, fname) )
 
-        elif fname.endswith('.pir'):
-            fspir, imp = tools.readPIR(fname)
-            IRs.append( (fspir, imp, fname) )
+def lee_IR(fname, fs=0):
+    """ lee un impulso, devuelve (fs, imp, fname)
+    """
+    if fname.endswith('.wav'):
+        fswav, imp = tools.readWAV(fname)
+        return (fswav, imp, fname)
 
-        elif fname.endswith('.pcm') or \
-             fname.endswith('.bin') or \
-             fname.endswith('.f32'):
-            if fs:
-                imp = tools.readPCM(fname, dtype='float32')
-                IRs.append( (fs, imp, fname) )
-            else:
-                print (__doc__)
-                sys.exit()
+    elif fname.endswith('.pir'):
+        fspir, imp = tools.readPIR(fname)
+        return (fspir, imp, fname)
 
-        else:   # it is supposed to be a text file
-            if fs:
-                imp = np.loadtxt(fname)
-                IRs.append( (fs, imp, fname) )
-            else:
-                print (__doc__)
-                sys.exit()
+    elif fname.endswith('.pcm') or \
+         fname.endswith('.bin') or \
+         fname.endswith('.f32'):
+        imp = tools.readPCM(fname, dtype='float32')
+        return (fs, imp, fname)
 
-    return IRs
+    else:   # it is supposed to be a text file
+        imp = np.loadtxt(fname)
+        return (fs, imp, fname)
 
 
 def prepara_eje_frecuencias(ax):
@@ -249,7 +297,7 @@ def check_lin_pha(imp, tol):
     result = False
 
     # Ensure the impulse is centered
-    center = np.argmax(imp)
+    center = tools.chunked_peak(imp, absolute=False)
     if center - imp.shape[0] // 2 > 1:
         return False
 
@@ -261,13 +309,137 @@ def check_lin_pha(imp, tol):
         begin = 0
 
     try:
-        result = np.allclose(imp[begin:center], imp[center + 1:][::-1], atol=atol)
+        result = tools.chunked_allclose(imp[begin:center], imp[center + 1:][::-1], atol=atol)
     except:
         print( '(!) error when checking for linear phase, sorry :-/ ' )
 
     return result
 
 
+def analiza_IR(fs, imp, magThr=-50.0, lp_tolerance=-60):
+    """ Las métricas de un impulso que muestran las gráficas:
+        magnitud, phase, GD, pk offset, GD promedio y si es linear phase
+    """
+    limp = len(imp)
+    peakOffsetms = np.round(tools.chunked_peak(imp) / fs * 1000, 1) # en ms
+
+    # Semiespectro hasta Nyquist: magnitud, phase desenrollada y
+    # Group Delay (en muestras), con una única rfft.
+    # Eliminamos (np.nan) los valores de GD fuera de
+    # la banda de paso, por debajo de un umbral configurable.
+    freqs, magdB, phase, gd = tools.rfft_response(imp, fs, mask_dB=magThr)
+
+    # Eliminamos (np.nan) los valores de phase fuera de
+    # la banda de paso, por debajo de un umbral configurable.
+    phaseClean  = np.full((len(phase)), np.nan)
+    mask = (magdB > magThr)
+    np.copyto(phaseClean, phase, where=mask)
+    phaseClean *= 180 / (2*np.pi)
+
+    # GD en muestras, lo convertimos a milisegundos
+    gdms = gd / fs * 1000
+    # Computamos el GD promedio (en ms) para mostrarlo en la gráfica
+    #   1. Vemos un primer promedio
+    gdmsAvg = np.round(np.nanmean(gdms), 1)
+    #   2. limpiamos las desviaciones > 5 ms respecto del promedio (wod: without deviations)
+    gdmswod = np.full((len(gdms)), np.nan)
+    mask = (gdms < (gdmsAvg + 5.0) ) # nota: se muestra un Warning porque se evalúan valores np.nan
+    np.copyto(gdmswod, gdms, where=mask)
+    #   3. Promedio recalculado sobre los valores without deviations
+    gdmsAvg = np.round(np.nanmean(gdms), 1)
+
+    return { 'freqs':         freqs,
+             'magdB':         magdB,
+             'phase':         phaseClean,
+             'phase_rad':     phase,
+             'gdms':          gdms,
+             'taps':          limp,
+             'peakOffsetms':  peakOffsetms,
+             'gdmsAvg':       gdmsAvg,
+             'linpha':        check_lin_pha(imp, lp_tolerance) }
+
+
+def resumen(fname, fs, A, lp_tolerance):
+    """ resultados de 'analiza_IR' para el modo batch (sin las curvas)
+    """
+    imax = np.nanargmax(A['magdB'])
+    return { 'file':            fname,
+             'fs':              fs,
+             'taps':            A['taps'],
+             'peakOffset_ms':   float(A['peakOffsetms']),
+             'GDavg_ms':        float(A['gdmsAvg']),
+             'linear_phase':    bool(A['linpha']),
+             'lp_tolerance_dB': lp_tolerance,
+             'max_dB':          float(A['magdB'][imax]),
+             'max_Hz':          float(A['freqs'][imax]) }
+
+
+def analiza_archivo(fname, fs, magThr, lp_tolerance, curves=False, frd=False):
+    """ tarea del modo batch: lee y analiza un impulso
+    """
+    fs, imp, fname = lee_IR(fname, fs)
+    A = analiza_IR(fs, imp, magThr, lp_tolerance)
+    R = resumen(fname, fs, A, lp_tolerance)
+    if frd:
+        # phase sin enmascarar, en grados (-180, 180]
+        pha = np.angle( np.exp(1j * A['phase_rad']), deg=True )
+        tools.saveFRD( os.path.splitext(fname)[0] + '.frd', A['freqs'], A['magdB'], pha,
+                       fs=fs, verbose=False )
+    if curves:
+        R['curves'] = { k: A[k] for k in ('freqs', 'magdB', 'phase', 'gdms') }
+    return R
+
+
+def batch(fnames, fs):
+    """ analiza los impulsos en un pool de procesos y guarda los resultados
+    """
+    curves = bool(curvesName)
+    args = (fs, magThr, lp_tolerance, curves, saveFRD)
+
+    results = []
+    if nproc == 1 or len(fnames) == 1:
+        jobs = [ (f, lambda f=f: analiza_archivo(f, *args)) for f in fnames ]
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=nproc)
+        jobs = [ (f, pool.submit(analiza_archivo, f, *args).result) for f in fnames ]
+
+    for fname, result in jobs:
+        try:
+            R = result()
+        except Exception as e:
+            print( f'(!) {fname}: {e}' )
+            continue
+        print( f'{fname}: {R["taps"]} taps, pk offset {R["peakOffset_ms"]} ms, '
+               f'GD avg {R["GDavg_ms"]} ms, '
+               f'{"" if R["linear_phase"] else "not "}linear phase' )
+        results.append(R)
+
+    if pool:
+        pool.shutdown()
+
+    # Curvas en un .npz, con el número de orden del archivo como prefijo
+    if curves:
+        arrays = {}
+        for i, R in enumerate(results):
+            for k, v in R.pop('curves').items():
+                arrays[f'{i}_{k}'] = v
+        arrays['files'] = np.array( [ R['file'] for R in results ] )
+        np.savez(curvesName, **arrays)
+        print( f'curves saved: {curvesName}' )
+
+    if outName.endswith('.csv'):
+        with open(outName, 'w', newline='') as f:
+            if results:
+                w = csv.DictWriter(f, fieldnames=list(results[0]))
+                w.writeheader()
+                w.writerows(results)
+    else:
+        with open(outName, 'w') as f:
+            json.dump(results, f, indent=1)
+    print( f'results saved: {outName}' )
+
+
 if __name__ == "__main__":
 
     dBtop   = 5  # inicial lugo se reajustará
@@ -283,7 +455,19 @@ if __name__ == "__main__":
         print (__doc__)
         sys.exit()
 
-    IRs = lee_commandline(sys.argv[1:])
+    lee_commandline(sys.argv[1:])
+
+    if noPlot:
+        batch(fnames, fs)
+        sys.exit()
+
+    # (i) matplotlib solo se importa para plotear
+    from matplotlib import pyplot as plt
+    from matplotlib.ticker import EngFormatter
+    from matplotlib import gridspec             # customize subplots array
+    from plot_reducer import plot_reduced
+
+    IRs = [ lee_IR(fname, fs) for fname in fnames ]
 
     preparaGraficas()
 
@@ -294,47 +478,9 @@ if __name__ == "__main__":
     for IR in IRs:
 
         fs, imp, info = IR
-        fny = fs/2.0
-        limp = len(imp)
-        peakOffsetms = np.round(abs(imp).argmax() / fs * 1000, 1) # en ms
-
-        # Semiespectro
-        # whole=False --> hasta Nyquist
-        w, h = signal.freqz(imp, worN=int(len(imp)/2), whole=False)
-
-        # frecuencias trasladadas a Fs
-        freqs = w / np.pi * fny
-
-        # Magnitud:
-        magdB = 20 * np.log10(abs(h))
-
-        # Un wrapped Phase:
-        phase = np.unwrap( np.angle(h) )
-        # Eliminamos (np.nan) los valores de phase fuera de
-        # la banda de paso, por debajo de un umbral configurable.
-        phaseClean  = np.full((len(phase)), np.nan)
-        mask = (magdB > magThr)
-        np.copyto(phaseClean, phase, where=mask)
-        phaseClean *= 180 / (2*np.pi)
-
-        # Group Delay:
-        wgd, gd = signal.group_delay((imp, 1), w=int(len(imp)/2), whole=False)
-        # Eliminamos (np.nan) los valores fuera de
-        # la banda de paso, por debajo de un umbral configurable.
-        gdClean  = np.full((len(gd)), np.nan)
-        mask = (magdB < magThr)
-        np.copyto(gd, gdClean, where=mask)
-        # GD es en radianes los convertimos a milisegundos
-        gdms = gd / fs * 1000
-        # Computamos el GD promedio (en ms) para mostrarlo en la gráfica
-        #   1. Vemos un primer promedio
-        gdmsAvg = np.round(np.nanmean(gdms), 1)
-        #   2. limpiamos las desviaciones > 5 ms respecto del promedio (wod: without deviations)
-        gdmswod = np.full((len(gdms)), np.nan)
-        mask = (gdms < (gdmsAvg + 5.0) ) # nota: se muestra un Warning porque se evalúan valores np.nan
-        np.copyto(gdmswod, gdms, where=mask)
-        #   3. Promedio recalculado sobre los valores without deviations
-        gdmsAvg = np.round(np.nanmean(gdms), 1)
+        A = analiza_IR(fs, imp, magThr, lp_tolerance)
+        freqs, magdB, phaseClean, gdms = A['freqs'], A['magdB'], A['phase'], A['gdms']
+        limp, peakOffsetms, gdmsAvg = A['taps'], A['peakOffsetms'], A['gdmsAvg']
         GDavgs.append(gdmsAvg)
 
         # ---- PLOTEOS ----
@@ -345,23 +491,23 @@ if __name__ == "__main__":
         if tmp > dBtop:
             dBtop = tmp
         axMag.set_ylim(dBtop - dBrange, dBtop)
-        axMag.plot(freqs, magdB, label=info)
+        plot_reduced(axMag, freqs, magdB, label=info)
         color = axMag.lines[-1].get_color() # anotamos el color de la última línea
 
         # Phase
         if plotPha:
-            axPha.plot(freqs, phaseClean, "-", linewidth=1.0, color=color)
+            plot_reduced(axPha, freqs, phaseClean, "-", linewidth=1.0, color=color)
 
         # Ploteo del GD con autoajuste del top
         ymin = peakOffsetms - 25
         ymax = peakOffsetms + 75
         axGD.set_ylim(bottom = ymin, top = ymax)
-        axGD.plot(freqs, gdms, "--", linewidth=1.0, color=color)
+        plot_reduced(axGD, freqs, gdms, "--", linewidth=1.0, color=color)
 
         # Plot del IR
         # (i) Opcionalmente podemos pintar los impulsos en una sola fila
         rotuloIR = str(limp) + " taps - pk offset " + str(peakOffsetms) + " ms"
-        if check_lin_pha(imp, lp_tolerance):
+        if A['linpha']:
             rotuloIR += f'\nlinear phase (tolerance {lp_tolerance} dB)'
         else:
             rotuloIR += f'\nnot linear phase (tolerance {lp_tolerance} dB)'
@@ -378,7 +524,7 @@ if __name__ == "__main__":
         IRnum += 1
         axIR.set_xticks(range(0,len(imp),10000))
         axIR.ticklabel_format(style="sci", axis="x", scilimits=(0,0))
-        axIR.plot(imp, "-", linewidth=1.0, color=color)
+        plot_reduced(axIR, np.arange(limp), imp, "-", kind="lin", linewidth=1.0, color=color)
 
     # Mostramos los valores de GD avg de cada impulso:
     GDtitle = 'GD avg:    ' + '    '.join([str(x) for x in GDavgs]) + ' (ms)'
@@ -1,7 +1,7 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
 """
-    v0.1beta
+    v0.1b
 
     Convierte una IR de DRC originada en REW Room EQ Wizard
     en un archivo raw float32 (.pcm) adecuado para un convolver
@@ -14,6 +14,9 @@
             minimum phase descartamos el exceso de phase si lo hubiera,
             resultando en un impulso con el pico al inicio.
 """
+# v0.1b
+#   - La fase mínima se calcula sobre el semiespectro (pydsd.minphimp),
+#     con la mitad de memoria y de cálculo FFT que con el espectro completo.
 
 import sys
 import numpy as np
@@ -29,6 +32,10 @@ if __name__ == "__main__":
     # taps de salida deseados (PDTE PASAR COMO ARGUMENTO)
     m = 2 ** 15
 
+    # relleno con ceros de la FFT, limita el aliasing del cepstrum
+    # (1 equivale a la FFT del impulso tal cual)
+    pad = 1
+
     # Archivos de entrada y de salida
     fin  = sys.argv[1]
     fout = fin.replace(".wav", ".pcm")
@@ -36,14 +43,9 @@ if __name__ == "__main__":
     # Leemos el impulso de entrada imp1
     fs, imp1 = tools.readWAV(fin)
 
-    # Espectro completo
-    h = np.fft.fft(imp1)
-    # Réplica del espectro completo en fase mínima
-    hmp = dsd.minphsp(h)
-
-    # Convertimos el espectro completo mp en un IR, se toma la parte real.
-    imp2 = np.fft.ifft( hmp )
-    imp2 = np.real(imp2)
+    # Réplica en fase mínima: semiespectro (rfft), fase mínima por el
+    # cepstrum real, y de vuelta al dominio del tiempo (irfft, real)
+    imp2 = dsd.minphimp(imp1, pad=pad)
 
     # Lo cortamos a la longitud deseada y aplicamos una ventana:
     imp2 = dsd.semiblackmanharris(m) * imp2[:m]
@@ -26,15 +26,15 @@ import sys
 import os
 import json
 import numpy as np
-from scipy.interpolate import interp1d
 from matplotlib import pyplot as plt
 
 HOME = os.path.expanduser("~")
 sys.path.append(f'{HOME}/audiotools')
 import iso226
 from iso_R import get_iso_R
-from tools import extrap1d, min_phase_from_real_mag
-from smoothSpectrum import smoothSpectrum as smooth
+from tools import min_phase_from_real_mag, fft_size, set_min_phase_cache_dir
+from interp_plan import get_plan
+from smoothSpectrum import get_operator, set_cache_dir
 
 # Default parameters
 refSPL  = 83
@@ -94,10 +94,11 @@ def doplot():
 
 
 def phase_from_mag(freqs, curves):
-    phases = np.zeros( curves.shape )
-    for i, curve in enumerate(curves):
-        _,_,pha = min_phase_from_real_mag( freqs, curve)
-        phases[i] = pha
+    # all curves at once (one curve per row), FFT sized for our lowest
+    # band and sampling rate
+    wsize = fft_size( freqs[0], fs )
+    print( f'(equal_loudness) min-phase FFT size: {wsize} @ fs={fs}' )
+    _,_,phases = min_phase_from_real_mag( freqs, curves, fs=fs, wsize=wsize )
     return phases
 
 
@@ -117,14 +118,11 @@ def extend_curves(freqs, curves, new_freqs, Noct=0):
     """ Extrapolates (freqs,curves) by using  a new frequency bands 'new_freqs'.
         Noct will smooth the resulting curves in 1/Noct, Noct=0 will not.
     """
-    new_curves = np.zeros( (curves.shape[0], len(new_freqs)) )
-    for i, curve in enumerate(curves):
-        I = interp1d(freqs, curve)
-        X = extrap1d( I )
-        if Noct:
-            new_curves[i] = smooth(new_freqs, X(new_freqs), Noct)
-        else:
-            new_curves[i] = X(new_freqs)
+    # all curves interpolated at once (one curve per row)
+    new_curves = get_plan(freqs, new_freqs, "extrap").apply(curves)
+    # The smoothing kernels are computed once for the whole set of curves
+    if Noct:
+        new_curves = get_operator(new_freqs, Noct).apply(new_curves)
     return new_curves
 
 
@@ -150,7 +148,7 @@ def make_curves():
         loudcomp_mag[phon] = loudcomp_mag[phon] - phon + refSPL
 
     # Retrieving phase from mag
-    print( '(equal_loudness) retrieving phase from relative magnitudes, will take a while ...' )
+    print( '(equal_loudness) retrieving phase from relative magnitudes ...' )
     loudcomp_pha = phase_from_mag( freqs, loudcomp_mag)
     print( '(equal_loudness) done.' )
 
@@ -184,6 +182,10 @@ if __name__ == '__main__':
         elif '-s' in opc:
             save = True
 
+    # Keep smoothing kernels and min-phase results on disk for later runs
+    set_cache_dir()
+    set_min_phase_cache_dir()
+
     if type(refSPL) == str:
         refSPLs = json.loads(f'[{refSPL}]')
     else:
@@ -5,7 +5,7 @@
 
     Usage:
 
-    room_curves.py   -RXX  -fs=X  -loS=X  -loF=X  -hiF=X   --save  --plot
+    room_curves.py   -RXX  -fs=X  -loS=X  -loF=X  -hiF=X  -smooth=X  --save  --plot
 
         -RXX    R10 | R20 | R40 | R80  iso R series (default: R20 ~ 1/3 oct)
 
@@ -18,6 +18,10 @@
 
         -hiF=X  High roll-off corner frequency (default: X=500 Hz)
 
+        -smooth=X   oct | erb | bark  bandwidth scale for the 1/2 smoothing
+                    of the high roll-off (default: oct, 1/2 octave),
+                    erb and bark follow the ear's critical bands.
+
         --save  save curves to disk
 
         --plot
@@ -42,8 +46,9 @@ from matplotlib import pyplot as plt
 HOME = os.path.expanduser("~")
 sys.path.append(f'{HOME}/audiotools')
 from iso_R import get_iso_R
-from smoothSpectrum import smoothSpectrum
-from tools import shelf1low, shelf2low, min_phase_from_real_mag
+from smoothSpectrum import get_operator, set_cache_dir
+from tools import shelf1low, shelf2low, min_phase_from_real_mag, fft_size, \
+                  set_min_phase_cache_dir
 
 
 # Defaults
@@ -53,6 +58,7 @@ from tools import shelf1low, shelf2low, min_phase_from_real_mag
 shelf_order = 1     # <1>st or <2>nd low shelf order (slope)
 fc_low  = 120       # low shelf center frequency
 fc_high = 500       # high roll-off corner frecuency
+smooth_scale = 'oct'    # high roll-off smoothing bandwidths: 'oct', 'erb', 'bark'
 
 # Will generate a set of curves by combining low shelf and hight tilt ranges
 lo_range = 6; lo_step = 1.0
@@ -75,13 +81,17 @@ def make_low(fc, gain):
     return 20 * np.log10( np.abs(h) )
 
 
-def make_high(fc, gain):
+def make_highs(fc, gains):
+    """ one high roll-off curve for each of the given gains,
+        all of them smoothed at once
+    """
     curve = np.zeros( len(freqs) )
     i0 = len(curve[ freqs < fc ])
     for i, g in enumerate(curve):
         if i > i0:
-            curve[i] = (i-i0) * gain / (len(curve)-i0)
-    return smoothSpectrum(freqs, curve, Noct=2)
+            curve[i] = (i-i0) / (len(curve)-i0)
+    curves = np.outer(gains, curve)
+    return get_operator(freqs, Noct=2, scale=smooth_scale).apply(curves)
 
 
 def plotsamples():
@@ -112,23 +122,34 @@ def make_curves():
     curves stored in a dictionary
     """
 
-    print(f'cumputing a full set of curves, will take a while ...')
+    print(f'computing a full set of curves ...')
 
     global freqs, curves
 
     freqs = get_iso_R(Rseries, fmin=fmin, fs=fs)
 
-    curves = {}
+    chis = make_highs( fc=fc_high, gains=hi_gains )
+
+    # magnitudes for all combinations, then their phases computed at once
+    names = []
+    mags  = []
     for lo_gain in lo_gains:
         clo = make_low( fc=fc_low, gain=lo_gain )
-        for hi_gain in hi_gains:
-            chi = make_high( fc=fc_high, gain=hi_gain )
-            hc_mag = clo + chi
-            _,_,hc_pha = min_phase_from_real_mag( freqs, hc_mag)
+        for hi_gain, chi in zip(hi_gains, chis):
             lo_str = str(round(float(lo_gain), 1))
             hi_str = str(round(float(hi_gain), 1))
             hi_str = f'-{hi_str}'.replace('--', '-')
-            curves[f'+{lo_str}{hi_str}'] = {'mag': hc_mag, 'pha': hc_pha}
+            names.append( f'+{lo_str}{hi_str}' )
+            mags.append( clo + chi )
+
+    mags = np.array(mags)
+    wsize = fft_size( freqs[0], fs )
+    print(f'min-phase FFT size: {wsize} @ fs={fs}')
+    _,_,phas = min_phase_from_real_mag( freqs, mags, fs=fs, wsize=wsize )
+
+    curves = {}
+    for name, hc_mag, hc_pha in zip(names, mags, phas):
+        curves[name] = {'mag': hc_mag, 'pha': hc_pha}
 
 
 def save_curves():
@@ -191,6 +212,13 @@ if __name__ == '__main__':
             else:
                 raise ValueError('Hi roll-off corner 250 ... 10000 Hz')
 
+        elif opc[:8] == '-smooth=':
+            value = opc[8:]
+            if value in ('oct', 'erb', 'bark'):
+                smooth_scale = value
+            else:
+                raise ValueError('Smoothing scale choose oct, erb or bark')
+
         elif opc == '--save' or opc == '-s':
             savetodisk = True
 
@@ -206,7 +234,7 @@ if __name__ == '__main__':
 
     print(f'Using {Rseries} iso frequencies')
     print(f'Low shelf center freq: {fc_low} Hz, slope: {shelf_slope_info}')
-    print(f'High roll-off corner:  {fc_high} Hz')
+    print(f'High roll-off corner:  {fc_high} Hz, smoothing: 1/2 {smooth_scale}')
 
     # The values of low shelf variation:
     lo_gains    = np.arange(0, lo_range + lo_step, lo_step)
@@ -214,6 +242,10 @@ if __name__ == '__main__':
     # The values of high tilt variation:
     hi_gains    = np.arange(0, hi_range + hi_step, hi_step) * -1
 
+    # Keep smoothing kernels and min-phase results on disk for later runs
+    set_cache_dir()
+    set_min_phase_cache_dir()
+
     # Making curves for all combinations,
     # can result in a large number of files:
     make_curves()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+    Interpolation plans between fixed frequency grids.
+
+    The same grid to grid mappings are used again and again (e.g. iso226
+    FREQS --> iso R20, or any curve --> the FFT bins of tools.fft_spectrum).
+    An InterpPlan computes once the source indices and weights for every
+    destination point, then it is applied to any number of curves as a
+    single gather and multiply-add:
+
+        P = get_plan(freq, fft_freq, "extrap")
+        mags = P.apply(curves)      # curves shape: (len(freq),)
+                                    #            or (Ncurves, len(freq))
+
+    Methods:
+
+        "linear"    linear interpolation, NaN out of the source range
+        "extrap"    linear interpolation, and linear extrapolation out of
+                    range from the first or last segment slope
+        "hold"      linear interpolation, and the end values held out of range
+        "quadratic" quadratic spline (as interp1d kind="quadratic"), with
+                    the end polynomials extrapolated out of range
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+from scipy.interpolate import BSpline, make_interp_spline
+from npcache import array_key, LRUCache
+
+METHODS = ("linear", "extrap", "hold", "quadratic")
+
+# Plans already computed (see get_plan)
+_plans = LRUCache(maxsize=32)
+
+
+class InterpPlan:
+    """
+    Interpolation from the source grid 'x' onto the destination grid 'xnew'.
+
+    'x' needs at least 2 distinct points (3 for "quadratic"), unsorted 'x'
+    is sorted as interp1d does. At a repeated point the segment on its left
+    ends at the first value, and the point itself and the segment on its
+    right take the last value, as in interp1d "linear". "quadratic" keeps the last value of
+    every repeated point (interp1d does not admit them). 'xnew' can be any
+    array of frequencies.
+    """
+
+    def __init__(self, x, xnew, method="linear"):
+
+        x    = np.asarray(x, dtype=float)
+        xnew = np.asarray(xnew, dtype=float)
+
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}")
+        if x.ndim != 1 or len(x) < 2:
+            raise ValueError("'x' must be a 1-d array of 2 or more points")
+
+        # unsorted source points: the curves will be reordered as 'x'
+        self.nx    = len(x)
+        self.order = None
+        if np.any( np.diff(x) < 0 ):
+            self.order = np.argsort(x, kind='stable')
+            x = x[self.order]
+        if x[0] == x[-1]:
+            raise ValueError("'x' must have 2 or more distinct points")
+
+        # the spline needs distinct points, keep the last value of each
+        if method == "quadratic" and np.any( np.diff(x) == 0 ):
+            keep = np.r_[ np.diff(x) != 0, True ]
+            self.order = ( np.arange(len(x)) if self.order is None
+                           else self.order )[keep]
+            x = x[keep]
+
+        self.x      = x
+        self.xnew   = xnew
+        self.method = method
+        self.shape  = xnew.shape
+
+        if method == "quadratic":
+            self._spline_plan()
+            return
+
+        # segment of every destination point (x[i] <= xn < x[i+1], as
+        # np.interp), and the weight of its upper source point. Out of range
+        # points take the first or last segment of distinct points.
+        xn = xnew.ravel()
+        i  = np.searchsorted(x, xn, side='right') - 1
+        i  = np.clip( i, np.searchsorted(x, x[0],  side='right') - 1,
+                         np.searchsorted(x, x[-1], side='left')  - 1 )
+        t  = (xn - x[i]) / (x[i+1] - x[i])
+        # the last point takes its last value
+        end = xn == x[-1]
+        i[end], t[end] = len(x) - 2, 1.0
+
+        outside = (xn < x[0]) | (xn > x[-1])
+        if method == "hold":
+            t = np.clip(t, 0, 1)
+
+        self.i0   = i
+        self.t    = t
+        self.mask = outside if (method == "linear" and np.any(outside)) else None
+
+
+    def _spline_plan(self):
+        """ quadratic spline: out = B @ A^-1 @ y, where A and B are the
+            B-spline basis evaluated at 'x' and at 'xnew'
+        """
+        n, k = len(self.x), 2
+        t = make_interp_spline(self.x, np.zeros(n), k=k).t
+        A = BSpline.design_matrix(self.x, t, k)
+        self.lu = splu( sparse.csc_matrix(A) )
+
+        # Out of range points extrapolate the end polynomials, where only
+        # the first (or last) k+1 basis functions are non zero.
+        xn = self.xnew.ravel()
+        B  = BSpline.design_matrix(np.clip(xn, self.x[0], self.x[-1]), t, k).tolil()
+        for rows, cols in ( (xn < self.x[0],  np.arange(k + 1)),
+                            (xn > self.x[-1], np.arange(n - k - 1, n)) ):
+            if np.any(rows):
+                c = np.zeros( (n, k + 1) )
+                c[cols, np.arange(k + 1)] = 1
+                vals = BSpline(t, c, k, extrapolate=True)(xn[rows])
+                B[np.ix_(np.flatnonzero(rows), cols)] = vals
+        self.B = sparse.csr_matrix(B)
+
+
+    def apply(self, y):
+        """
+        y:  a curve (1-d) or a set of curves (N-d, one curve along the
+            last axis) sampled at self.x
+
+        Returns the interpolated curve(s), last axis shaped as self.xnew.
+        """
+        y = np.asarray(y, dtype=float)
+        if y.shape[-1] != self.nx:
+            raise ValueError("'y' last axis must be the same size as 'x'")
+
+        lead = y.shape[:-1]
+        if self.order is not None:
+            y = y[..., self.order]
+
+        if self.method == "quadratic":
+            Y = y.reshape(-1, len(self.x)).T
+            out = ( self.B @ self.lu.solve(Y) ).T
+
+        else:
+            out = y[..., self.i0] * (1 - self.t) + y[..., self.i0 + 1] * self.t
+            if self.mask is not None:
+                out[..., self.mask] = np.nan
+
+        return out.reshape( lead + self.shape )
+
+
+    __call__ = apply
+
+
+def get_plan(x, xnew, method="linear"):
+    """
+    The InterpPlan for (x, xnew, method), kept in memory so that repeated
+    mappings between the same grids do not compute it again.
+    """
+    key = array_key(np.asarray(x, dtype=float), np.asarray(xnew, dtype=float),
+                    method)
+    P = _plans.get(key)
+    if P is None:
+        P = InterpPlan(x, xnew, method)
+        _plans.put(key, P)
+    return P
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+    Small caching helpers for numpy based computations.
+
+        array_key()     a hash key for arrays and parameters
+
+        LRUCache        in memory cache with least recently used eviction
+
+        NpzStore        on disk folder of .npz files, limited in total size,
+                        the least recently used files are evicted first.
+
+        PcmStore        on disk folder of content addressed float32 .pcm
+                        files (FIRs) with a JSON manifest of keys, limited
+                        in total size and age.
+"""
+import os
+import time
+import json
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+
+
+def array_key(*items):
+    """ A hex digest identifying the given items, numpy arrays
+        (dtype, shape and content) or plain scalar/string parameters.
+    """
+    h = hashlib.sha1()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            h.update( f'{item.dtype}{item.shape}'.encode() )
+            h.update( np.ascontiguousarray(item).tobytes() )
+        else:
+            h.update( repr(item).encode() )
+        h.update( b'|' )
+    return h.hexdigest()
+
+
+class LRUCache:
+    """ A dictionary alike cache keeping up to 'maxsize' items,
+        the least recently used item is discarded when full.
+
+        'max_bytes' also limits the total size of the items, as given by
+        their 'nbytes' attribute (numpy arrays, or any object providing
+        it). The last item put is always kept.
+    """
+
+    def __init__(self, maxsize=16, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.nbytes = 0
+
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+        self.items.move_to_end(key)
+        return self.items[key]
+
+
+    def put(self, key, value):
+        if key in self.items:
+            self.nbytes -= getattr(self.items[key], 'nbytes', 0)
+        self.items[key] = value
+        self.items.move_to_end(key)
+        self.nbytes += getattr(value, 'nbytes', 0)
+        while len(self.items) > 1 and (
+                len(self.items) > self.maxsize or
+                (self.max_bytes is not None and self.nbytes > self.max_bytes) ):
+            _, old = self.items.popitem(last=False)
+            self.nbytes -= getattr(old, 'nbytes', 0)
+
+
+    def clear(self):
+        self.items.clear()
+        self.nbytes = 0
+
+
+    def __contains__(self, key):
+        return key in self.items
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+class NpzStore:
+    """ A folder of '<key>.npz' files limited to 'max_bytes' in total.
+
+        Files are written atomically. The folder size is scanned once and
+        then kept as a running total, so saving does not list the folder.
+        When the total grows beyond 'max_bytes' the least recently used
+        files (by modification time, refreshed on every load) are removed
+        down to 'low_water' * max_bytes, so the scan is not repeated on
+        every following save.
+    """
+
+    def __init__(self, folder, max_bytes=64 * 2**20, low_water=0.8):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        os.makedirs(folder, exist_ok=True)
+        self.total = sum( e[1] for e in self._entries() )
+
+
+    def path(self, key):
+        return f'{self.folder}/{key}.npz'
+
+
+    def load(self, key):
+        """ returns a dictionary of arrays, or None if not stored
+        """
+        fname = self.path(key)
+        try:
+            with np.load(fname) as npz:
+                arrays = { k: npz[k] for k in npz.files }
+        except (OSError, ValueError):
+            return None
+        # another process may have evicted it meanwhile
+        try:
+            os.utime(fname)
+        except OSError:
+            pass
+        return arrays
+
+
+    def save(self, key, **arrays):
+        fname = self.path(key)
+        tmp = f'{fname}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        try:
+            self.total -= os.path.getsize(fname)
+        except OSError:
+            pass
+        self.total += os.path.getsize(tmp)
+        os.replace(tmp, fname)
+        if self.total > self.max_bytes:
+            self.evict()
+
+
+    def _entries(self):
+        """ (mtime, size, fname) of the stored files
+        """
+        entries = []
+        for fname in os.listdir(self.folder):
+            if not fname.endswith('.npz'):
+                continue
+            try:
+                st = os.stat(f'{self.folder}/{fname}')
+            except OSError:
+                continue
+            entries.append( (st.st_mtime, st.st_size, fname) )
+        return entries
+
+
+    def evict(self):
+        """ removes the least recently used files until fitting
+            low_water * max_bytes, and updates the running total
+            (other processes may have written to the folder too)
+        """
+        entries = self._entries()
+        total = sum( e[1] for e in entries )
+        if total > self.max_bytes:
+            target = self.low_water * self.max_bytes
+            for _, size, fname in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(f'{self.folder}/{fname}')
+                except OSError:
+                    pass
+                total -= size
+        self.total = total
+
+
+class PcmStore:
+    """ A folder of content addressed float32 '<sha1>.pcm' files (FIRs),
+        and a 'manifest.json' mapping keys to them:
+
+            { key: {"blob": sha1, "info": {...}, "used": timestamp}, ... }
+
+        Identical FIRs stored under different keys share the same file.
+        Entries not used for 'max_age' seconds are removed, then the least
+        recently used ones until the files fit 'max_bytes' in total.
+
+        The folder can be shared by several processes: the manifest is
+        read again and written under an exclusive lock ('manifest.lock')
+        on every change, and the blobs are written under the same lock.
+    """
+
+    def __init__(self, folder, max_bytes=256 * 2**20, max_age=90 * 86400):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(folder, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+
+    def path(self, blob):
+        return f'{self.folder}/{blob}.pcm'
+
+
+    @contextmanager
+    def _locked(self):
+        """ exclusive access to the folder, with the manifest up to date
+        """
+        with open(f'{self.folder}/manifest.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.manifest = self._read_manifest()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def get(self, key):
+        """ returns the stored FIR as a copy-on-write np.memmap, or None
+            (it can be modified in place, the file is left unchanged)
+        """
+        with self._locked():
+            entry = self.manifest.get(key)
+            if entry is None:
+                return None
+            try:
+                fir = np.memmap(self.path(entry['blob']), dtype='float32', mode='c')
+            except (OSError, ValueError):
+                del self.manifest[key]
+                self._write_manifest()
+                return None
+            entry['used'] = time.time()
+            self._write_manifest()
+            return fir
+
+
+    def put(self, key, fir, info=None):
+        """ stores 'fir' as float32 under 'key', returns it as get() does,
+            or None if it does not fit in max_bytes
+        """
+        raw = np.ascontiguousarray(fir, dtype='float32')
+        if raw.nbytes > self.max_bytes:
+            return None
+        blob = hashlib.sha1( raw.tobytes() ).hexdigest()
+        fname = self.path(blob)
+
+        with self._locked():
+            if not os.path.exists(fname):
+                tmp = f'{fname}.{os.getpid()}.tmp'
+                raw.tofile(tmp)
+                os.replace(tmp, fname)
+            self.manifest[key] = {'blob': blob, 'info': info or {}, 'used': time.time()}
+            self._evict()
+
+        return self.get(key)
+
+
+    def evict(self):
+        """ removes old entries, then the least recently used ones until
+            fitting max_bytes, and the files no longer referenced
+        """
+        with self._locked():
+            self._evict()
+
+
+    def _evict(self):
+        """ evict() with the lock already held
+        """
+        now = time.time()
+        for key in [ k for k, e in self.manifest.items()
+                     if now - e['used'] > self.max_age ]:
+            del self.manifest[key]
+
+        def size(blob):
+            try:
+                return os.path.getsize( self.path(blob) )
+            except OSError:
+                return 0
+
+        blobs = {}      # blob: last used
+        for e in self.manifest.values():
+            blobs[e['blob']] = max( blobs.get(e['blob'], 0), e['used'] )
+        total = sum( size(b) for b in blobs )
+        for blob, _ in sorted( blobs.items(), key=lambda item: item[1] ):
+            if total <= self.max_bytes:
+                break
+            total -= size(blob)
+            for key in [ k for k, e in self.manifest.items() if e['blob'] == blob ]:
+                del self.manifest[key]
+
+        self._write_manifest()
+
+        referenced = { e['blob'] for e in self.manifest.values() }
+        for fname in os.listdir(self.folder):
+            if fname.endswith('.pcm') and fname[:-4] not in referenced:
+                try:
+                    os.remove(f'{self.folder}/{fname}')
+                except OSError:
+                    pass
+
+
+    def _read_manifest(self):
+        try:
+            with open(f'{self.folder}/manifest.json') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+    def _write_manifest(self):
+        fname = f'{self.folder}/manifest.json'
+        tmp = f'{fname}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, fname)
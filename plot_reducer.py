@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+    Reduction of the data drawn by matplotlib for large curves.
+
+    A 256 Ktaps FIR gives 128 K spectrum points and 256 K IR samples per
+    curve, far more than the pixels of a plot. Here the data of every line
+    is reduced to a min/max envelope per display column, so that peaks and
+    notches are kept, and it is computed again for the visible range when
+    the axes are zoomed or panned:
+
+        line = plot_reduced(ax, freqs, magdB, kind="log", label="...")
+        line = plot_reduced(axIR, np.arange(len(imp)), imp, kind="lin")
+
+    kind:
+
+        "log"   log spaced columns, for spectra on a log frequency axis
+        "lin"   linear columns, for time traces
+
+    (i) matplotlib is not imported here, only the given Axes are used.
+"""
+import numpy as np
+
+# Minimum number of columns when the axes width is not yet known
+MIN_COLUMNS = 200
+
+
+def minmax_envelope(x, y, xmin, xmax, ncols, kind="lin"):
+    """
+    Min/max envelope of the sorted 'x', 'y' data within [xmin, xmax] over
+    'ncols' linear or log spaced columns.
+
+    Returns the x, y to be plotted: two points (min and max) per non empty
+    column at its center, or the raw data in range if it is not bigger than
+    the envelope. NaN values are ignored (np.fmin / np.fmax).
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    if kind == "log":
+        xmin = max(xmin, x[x > 0][0]) if np.any(x > 0) else xmin
+        if xmin <= 0 or xmax <= xmin:
+            return x, y
+
+    # the data in range, plus one point on each side so that the
+    # line reaches the axes borders
+    i0 = max( np.searchsorted(x, xmin, side='left') - 1, 0 )
+    i1 = min( np.searchsorted(x, xmax, side='right') + 1, len(x) )
+    x, y = x[i0:i1], y[i0:i1]
+
+    if len(x) <= 2 * ncols:
+        return x, y
+
+    if kind == "log":
+        edges = np.geomspace(xmin, xmax, ncols + 1)
+        centers = np.sqrt(edges[:-1] * edges[1:])
+    else:
+        edges = np.linspace(xmin, xmax, ncols + 1)
+        centers = (edges[:-1] + edges[1:]) / 2
+
+    # first point of every column, empty columns are skipped
+    starts = np.searchsorted(x, edges[:-1], side='left')
+    stops  = np.searchsorted(x, edges[1:],  side='left')
+    stops[-1] = np.searchsorted(x, edges[-1], side='right')
+    used = stops > starts
+    starts, centers = starts[used], centers[used]
+
+    ymin = np.fmin.reduceat(y, starts)
+    ymax = np.fmax.reduceat(y, starts)
+    # reduceat reaches the end of the array from the last start
+    last = stops[used][-1]
+    if last < len(y):
+        ymin[-1] = np.fmin.reduce( y[starts[-1]:last] )
+        ymax[-1] = np.fmax.reduce( y[starts[-1]:last] )
+
+    xr = np.repeat(centers, 2)
+    yr = np.column_stack( (ymin, ymax) ).ravel()
+
+    # keep the out of range points at both ends
+    xr = np.concatenate( (x[:1], xr, x[-1:]) )
+    yr = np.concatenate( (y[:1], yr, y[-1:]) )
+    return xr, yr
+
+
+class ReducedLine:
+    """
+    A Line2D showing the min/max envelope of (x, y), recomputed on the
+    'xlim_changed' events of its Axes.
+    """
+
+    def __init__(self, ax, x, y, *args, kind="log", **kwargs):
+
+        if kind not in ("log", "lin"):
+            raise ValueError("kind must be 'log' or 'lin'")
+
+        x = np.asarray(x)
+        order = np.argsort(x, kind='stable') if np.any(np.diff(x) < 0) else slice(None)
+        self.x = x[order]
+        self.y = np.asarray(y)[order]
+        self.ax = ax
+        self.kind = kind
+
+        xr, yr = self.reduce( *self.data_range() )
+        self.line, = ax.plot(xr, yr, *args, **kwargs)
+        # the line keeps this object alive as long as it is plotted
+        self.line._reducer = self
+        self.cid = ax.callbacks.connect('xlim_changed', self.update)
+
+
+    def data_range(self):
+        x = self.x
+        if self.kind == "log" and np.any(x > 0):
+            return x[x > 0][0], x[-1]
+        return x[0], x[-1]
+
+
+    def columns(self):
+        try:
+            width = self.ax.get_window_extent().width
+        except Exception:
+            width = 0
+        return max( int(width), MIN_COLUMNS )
+
+
+    def reduce(self, xmin, xmax):
+        return minmax_envelope(self.x, self.y, xmin, xmax, self.columns(), self.kind)
+
+
+    def update(self, ax):
+        if self.line.axes is None:          # the line was removed
+            ax.callbacks.disconnect(self.cid)
+            return
+        xmin, xmax = sorted( ax.get_xlim() )
+        self.line.set_data( *self.reduce(xmin, xmax) )
+        ax.figure.canvas.draw_idle()
+
+
+def plot_reduced(ax, x, y, *args, kind="log", **kwargs):
+    """
+    As ax.plot(x, y, *args, **kwargs) for large curves, see ReducedLine.
+    Returns the Line2D.
+    """
+    return ReducedLine(ax, x, y, *args, kind=kind, **kwargs).line
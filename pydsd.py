@@ -23,6 +23,22 @@
 # + biquads como as 'DSP EQ cookbook', + shelfs como 'Linkwitzlab'
 # v0.04
 # - revisión de lininterp
+# v0.05
+# - lininterp usa planes de interpolación precalculados (interp_plan)
+# + minphssp: fase mínima a partir de semiespectros, por lotes
+# v0.06
+# - minphsp se calcula con minphssp sobre el semiespectro (rfft)
+# + minphimp: impulso de fase mínima, con relleno de ceros (pad)
+# v0.07
+# + biquads: diseño vectorizado de bancos de biquads (SOS)
+# + sosresponse: respuesta en frecuencia de bancos de biquads
+# v0.08
+# - crossButterworth, crossButterworthLP y crossLinkwitzRiley se sintetizan
+#   en el dominio de la frecuencia (SOS sobre rejilla rfft + irfft)
+#   en lugar de filtrar una delta, estables con órdenes altos.
+# + crossoverbank: todas las vías de un crossover en una pasada
+# v0.09
+# + caché en disco de los FIR de crossover (set_fir_cache_dir, fircached)
 # -----------------------------------------------------------
 # NOTAS:
 # - Abajo podremos ver código original de DSD en octave comentado con %%
@@ -31,8 +47,78 @@
 #   'ssp'   suele referirse a un semi spectro
 # -----------------------------------------------------------
 
+import os
+import inspect
+import functools
 import numpy as np
-from scipy import signal, interpolate
+from scipy import signal
+from scipy.fft import next_fast_len
+from interp_plan import get_plan
+from npcache import array_key, PcmStore
+
+# Los FIR de filtros IIR se sintetizan desde su respuesta en una rejilla rfft
+# al menos SOSFIR_PAD veces más larga que el FIR, y lo bastante larga para
+# que la cola del impulso que se solapa (aliasing) con los 'm' taps quede
+# por debajo de SOSFIR_TOL respecto del máximo (ver sosfir_len).
+SOSFIR_PAD = 2
+SOSFIR_TOL = 1e-9
+
+# Caché opcional en disco de FIR generados (ver set_fir_cache_dir)
+FIR_CACHE_DIR = os.path.expanduser('~/.cache/audiotools/fir')
+_fir_store    = None
+
+
+def set_fir_cache_dir(folder=FIR_CACHE_DIR, max_bytes=256 * 2**20, max_age=90 * 86400):
+    """
+    Activa la caché en disco de los FIR generados por las funciones
+    decoradas con @fircached: archivos .pcm float32 bajo 'folder' y un
+    manifiesto JSON, limitados a 'max_bytes' en total y a 'max_age'
+    segundos sin usarse. folder=None la desactiva.
+
+    (i) Los FIR guardados, y los devueltos por las funciones decoradas con
+        la caché activada, son float32 como en un .pcm: difieren del FIR
+        calculado en float64 por el redondeo (~1e-7 relativo al pico).
+    """
+    global _fir_store
+    _fir_store = PcmStore(folder, max_bytes, max_age) if folder else None
+
+
+def fircached(func):
+    """
+    Decorador para funciones que generan un FIR: con la caché activada
+    (set_fir_cache_dir) el FIR se busca por el nombre de la función y sus
+    parámetros, y solo se calcula si no estaba guardado.
+
+    (i) Con la caché activada el FIR se devuelve como np.memmap float32
+        copy-on-write, tal como se guardaría en un .pcm: admite cambios
+        in situ (p.ej. fir *= w) sin alterar el archivo guardado.
+    """
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _fir_store is None:
+            return func(*args, **kwargs)
+
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = bound.arguments
+        key = array_key( func.__module__, func.__name__,
+                         *[ np.asarray(v) if isinstance(v, (list, tuple, np.ndarray)) else v
+                            for v in params.values() ] )
+
+        fir = _fir_store.get(key)
+        if fir is None:
+            info = { 'func': func.__name__ }
+            info.update( { k: repr(v) for k, v in params.items() } )
+            fir = func(*args, **kwargs)
+            # si no cabe en la caché se devuelve tal cual
+            stored = _fir_store.put(key, fir, info)
+            if stored is not None:
+                fir = stored
+        return fir
+
+    return wrapper
 
 def biquad(fs, f0, Q, ftype, dBgain=0.0):
     """
@@ -122,6 +208,97 @@ def biquad(fs, f0, Q, ftype, dBgain=0.0):
     return b, a
 
 
+def biquads(fs, f0, Q, ftype, dBgain=0.0):
+    """
+    Vectorised version of biquad() for a bank of filters:
+
+        f0, Q, ftype, dBgain:   arrays (or scalars) broadcastable to the same
+                                length N, ftype as in biquad() (strings)
+
+    OUTPUT:
+
+        sos:        (N, 6) array of second order sections [b0 b1 b2 1 a1 a2]
+                    normalized to a0 = 1, as used by scipy.signal.sosfilt
+
+    All filters are computed at once, every type formula is evaluated for
+    the whole bank and then selected by each filter type.
+    """
+    f0, Q, dBgain, ftype = np.broadcast_arrays( np.atleast_1d(f0).astype(float),
+                                                np.atleast_1d(Q).astype(float),
+                                                np.atleast_1d(dBgain).astype(float),
+                                                np.atleast_1d(ftype) )
+
+    if np.any(Q <= 0):
+        raise ValueError("Q must be positive");
+
+    if np.any(f0 <= 0) or (fs <= 0):
+        raise ValueError("f must be positive");
+
+    ftype = np.char.lower( ftype.astype(str) )
+    types = ["lpf", "hpf", "notch", "peakingeq", "lowshelf", "highshelf"]
+    if not np.all( np.isin(ftype, types) ):
+        raise ValueError("Wrong biquad type")
+
+    A     = np.sqrt(10 ** (dBgain / 20.0))
+    w0    = 2.0 * np.pi * f0 / fs
+    cosw  = np.cos(w0)
+    alpha = np.sin(w0) / (2.0 * Q)
+    sqA   = 2 * np.sqrt(A) * alpha
+    one   = np.ones_like(w0)
+
+    # [b0, b1, b2, a0, a1, a2] for each type, as in biquad()
+    coeffs = {
+        "lpf":       ( (1 - cosw) / 2,   1 - cosw,   (1 - cosw) / 2,
+                       1 + alpha,       -2 * cosw,    1 - alpha ),
+        "hpf":       ( (1 + cosw) / 2, -(1 + cosw),  (1 + cosw) / 2,
+                       1 + alpha,       -2 * cosw,    1 - alpha ),
+        "notch":     ( one,             -2 * cosw,    one,
+                       1 + alpha,       -2 * cosw,    1 - alpha ),
+        "peakingeq": ( 1 + alpha * A,   -2 * cosw,    1 - alpha * A,
+                       1 + alpha / A,   -2 * cosw,    1 - alpha / A ),
+        "lowshelf":  (     A * ( (A+1) - (A-1)*cosw + sqA ),
+                       2 * A * ( (A-1) - (A+1)*cosw       ),
+                           A * ( (A+1) - (A-1)*cosw - sqA ),
+                               (A+1) + (A-1)*cosw + sqA,
+                          -2 * ( (A-1) + (A+1)*cosw       ),
+                               (A+1) + (A-1)*cosw - sqA ),
+        "highshelf": (     A * ( (A+1) + (A-1)*cosw + sqA ),
+                      -2 * A * ( (A-1) + (A+1)*cosw       ),
+                           A * ( (A+1) + (A-1)*cosw - sqA ),
+                               (A+1) - (A-1)*cosw + sqA,
+                           2 * ( (A-1) - (A+1)*cosw       ),
+                               (A+1) - (A-1)*cosw - sqA ),
+    }
+
+    ba = np.select( [ (ftype == t)[np.newaxis] for t in types ],
+                    [ np.stack(coeffs[t]) for t in types ] )
+
+    return ( ba / ba[3] ).T
+
+
+def sosresponse(sos, freqs, fs, cascade=True):
+    """
+    Frequency response of a bank of biquads
+
+        sos:        (N, 6) second order sections, as given by biquads()
+        freqs:      frequencies (Hz) where to evaluate the response
+        fs:         sampling rate
+        cascade:    True returns the response of all sections in cascade,
+                    (len(freqs),), False returns each section response,
+                    (N, len(freqs)).
+
+    The polynomials are evaluated at z = exp(jw) for all sections at once.
+    """
+    sos = np.atleast_2d(sos)
+    z1  = np.exp( -1j * 2 * np.pi * np.asarray(freqs) / fs )   # z^-1
+    z2  = z1 * z1
+    b0, b1, b2, a0, a1, a2 = [ c[:, np.newaxis] for c in sos.T ]
+    H = (b0 + b1 * z1 + b2 * z2) / (a0 + a1 * z1 + a2 * z2)
+    if cascade:
+        return np.prod(H, axis=0)
+    return H
+
+
 def biqshelving(fs, f1, f2, type):
     """
     %% Obtiene los coeficientes 'b,a' del filtro IIR asociado a
@@ -204,6 +381,83 @@ def centerimp(imp, m):
     return np.append( imp, np.zeros(extra2) )
 
 
+def buttersos(fs, n, flp=0, fhp=0):
+    """
+    Secciones SOS de un filtro Butterworth digital de orden n:
+    pasabajos si solo 'flp', pasaaltos si solo 'fhp', pasabanda si ambas.
+    Devuelve None si no hay frecuencias de corte.
+
+    (i) En el pasabanda los bordes se ordenan, así 'flp' y 'fhp' valen en
+        cualquier orden, como antes de pasar a secciones SOS.
+    """
+    wlp  = flp / (fs/2.0)   # Frecs normalizadas
+    whp  = fhp / (fs/2.0)
+
+    if   flp > 0  and fhp == 0:
+        return signal.butter(n, wlp,        btype="lowpass",  output="sos")
+
+    elif flp == 0 and fhp > 0:
+        return signal.butter(n, whp,        btype="highpass", output="sos")
+
+    elif flp > 0  and fhp > 0:
+        return signal.butter(n, sorted((wlp, whp)), btype="bandpass", output="sos")
+
+    return None
+
+
+def rfftfreqs(m, fs):
+    """ frecuencias de la rejilla rfft de un espectro completo de longitud m
+    """
+    return np.arange(m // 2 + 1) * fs / m
+
+
+def sosfir_len(sos, m, power=1, tol=SOSFIR_TOL):
+    """
+    Longitud (par) de la rejilla rfft con la que sintetizar 'm' taps del
+    filtro 'sos' elevado a 'power'.
+
+    La cola del impulso decae como el polo más lento, |h[n]| ~ n^(k-1)·r^n
+    (r = max|p|, k su multiplicidad por 'power'). La rejilla se alarga hasta
+    que esa envolvente baja de 'tol', así el aliasing de la cola sobre los
+    primeros 'm' taps no supera 'tol'.
+    """
+    L = SOSFIR_PAD * m
+
+    # polos de cada sección (sin pasar por los coeff 'b,a' del filtro completo)
+    p = np.concatenate( [ np.roots(sec[3:]) for sec in np.atleast_2d(sos) ] )
+    if len(p):
+        i = np.argmax( np.abs(p) )
+        r = np.abs(p[i])
+        if 0 < r < 1:
+            k = power * np.count_nonzero( np.abs(p - p[i]) < 1e-6 )
+            # n tal que n^(k-1)·r^n = tol, por iteración de punto fijo
+            n = np.log(tol) / np.log(r)
+            for _ in range(8):
+                n = ( np.log(tol) - (k - 1) * np.log(n) ) / np.log(r)
+            L = max( L, int(np.ceil(n)) )
+
+    L = next_fast_len(L, real=True)
+    while L % 2:
+        L = next_fast_len(L + 1, real=True)
+    return L
+
+
+def sosfir(sos, m, fs, power=1):
+    """
+    FIR de 'm' taps con las primeras 'm' muestras de la respuesta al impulso
+    del filtro 'sos', elevado a 'power' (2 para un Linkwitz-Riley).
+
+    Equivale a filtrar una delta(m), pero se calcula con la respuesta en
+    frecuencia de las secciones sobre una rejilla rfft (sosresponse) y una
+    irfft, sin la pérdida de precisión de los coeff 'b,a' de orden alto.
+    La longitud de la rejilla se ajusta al decaimiento del filtro (sosfir_len).
+    """
+    L  = sosfir_len(sos, m, power)
+    H  = sosresponse( sos, rfftfreqs(L, fs), fs ) ** power
+    return np.fft.irfft(H, L)[:m]
+
+
+@fircached
 def crossButterworth(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     """
     %% Obtiene el filtro FIR de un filtro Butterworth de orden n.
@@ -220,27 +474,17 @@ def crossButterworth(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     %%      fhp = Frecuencia de corte pasaaltos, si 0 u omitida sin corte pasaaltos.
     """
 
-    wlp  = flp / (fs/2.0)   # Frecs normalizadas
-    whp  = fhp / (fs/2.0)
-    imp  = delta(m)         # Delta a la que aplicaremos el filtro para entregar el FIR resultado
+    # 1. Calculamos las secciones SOS de un filtro Butterworth estandar
+    sos = buttersos(fs, n, flp, fhp)
 
-    # 1. Calculamos los coeff 'b,a' de la func de transferencia de un filtro Butterworth estandar
-    if   flp > 0  and fhp == 0:
-        b, a = signal.butter(n, wlp,       btype="lowpass",  analog=False, output="ba")
+    if sos is None:
+        return delta(m)  # delta sin filtrar
 
-    elif flp == 0 and fhp > 0:
-        b, a = signal.butter(n, whp,       btype="highpass", analog=False, output="ba")
-
-    elif flp > 0  and fhp > 0:
-        b, a = signal.butter(n, (wlp, whp), btype="bandpass", analog=False, output="ba")
-
-    else:
-        return imp  # delta sin filtrar
-
-    # 2. Aplicamos el Butterwoth al FIR
-    return signal.lfilter(b, a , imp)
+    # 2. El FIR es la respuesta al impulso del Butterworth (ver sosfir)
+    return sosfir(sos, m, fs)
 
 
+@fircached
 def crossButterworthLP(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     """
     %% Obtiene el filtro FIR de fase lineal con
@@ -259,20 +503,10 @@ def crossButterworthLP(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     %%      fhp = Frecuencia de corte pasaaltos, si 0 u omitida sin corte pasaaltos.
     """
 
-    wlp  = flp / (fs/2.0)   # freq normalizadas de los cortes
-    whp  = fhp / (fs/2.0)
-
-    # 1. Calculamos los coeff del filtro Butterworth
-    if flp > 0 and fhp == 0:
-        b, a = signal.butter(n, wlp, btype="lowpass", analog=False, output="ba")
-
-    elif flp == 0 and fhp > 0:
-        b, a = signal.butter(n, whp, btype="highpass", analog=False, output="ba")
-
-    elif flp > 0 and fhp > 0:
-        b, a = signal.butter(n, (wlp,whp), btype="bandpass", analog=False, output="ba")
+    # 1. Calculamos las secciones SOS del filtro Butterworth
+    sos = buttersos(fs, n, flp, fhp)
 
-    elif flp == 0 and fhp == 0:
+    if sos is None:
         imp = centerimp(deltacentered(m-1), m)
         return imp  # delta sin filtrar
 
@@ -289,21 +523,19 @@ def crossButterworthLP(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     # %% h = freqz(b, a , ssF, fs);
     # %% mag = abs(h);
 
-    # En Scipy freqz trabaja con freqs normalizadas no se usa la fs como parámetro.
-    # Aquí obtendremos el espectro completo para evitar reconstruirlo más abajo con 'wholesplp'.
-    _, h = signal.freqz(b, a, worN = m, whole = True)   # worN: 'w' array de frecuencias or 'N' bins
-    mag = np.abs(h)
+    # Aquí igual que en DSD: el SEMIespectro sobre la rejilla rfft, con las secciones SOS.
+    mag = np.abs( sosresponse( sos, rfftfreqs(m, fs), fs ) )
 
     # 2b. Regresamos a dom de t: se calcula el impulso correspondiente a 'mag':
-    #     se toma la parte real de la IFFT y se shiftea.
+    #     se toma la IFFT real del semiespectro y se shiftea.
 
     # Cód. original en Octave:
     # %% imp = real( ifft( wholesplp(mag') ) );
     # %% imp = circshift(imp, m/2);
 
-    imp = np.real( np.fft.ifft( mag ) )
+    imp = np.fft.irfft( mag, m )
     # shifteamos la IFFT para conformar el IR con el impulso centrado
-    imp = np.roll(imp, m/2)
+    imp = np.roll(imp, m // 2)
 
     # 3. Se aplica una ventana antes de devolver el resultado
     # Cód. original en Octave
@@ -311,6 +543,7 @@ def crossButterworthLP(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     return blackmanharris(m) * imp
 
 
+@fircached
 def crossLinkwitzRiley(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     """
     %% Obtiene el filtro FIR de un filtro Linkwitz-Riley de orden n, n par.
@@ -327,32 +560,103 @@ def crossLinkwitzRiley(fs=44100, m=32768, n=2, flp=0 , fhp=0):
     %%      fhp = Frecuencia de corte pasaaltos, si 0 u omitida sin corte pasaaltos.
     """
 
-    imp = delta(m)    # Delta a la que aplicaremos el filtro para entregar el FIR resultado
-
     if n % 2:
-        return imp          # Devolvemos una delta ya que el orden debe ser par.
+        return delta(m)     # Devolvemos una delta ya que el orden debe ser par.
 
-    n    = n / 2            # El orden se doblará en la cascada
-    wlp  = flp / (fs/2.0)   # Frecs normalizadas
-    whp  = fhp / (fs/2.0)
+    # 1. Obtenemos las secciones SOS de un filtro Butterworth estandar,
+    #    el orden se doblará en la cascada
+    sos = buttersos(fs, n // 2, flp, fhp)
 
-    # 1. Obtenemos los coeff de un filtro Butterworth estandar
-    if flp > 0  and  fhp == 0:
-        b, a = signal.butter(n, wlp, btype="lowpass", analog=False, output="ba")
+    if sos is None:
+        return delta(m)     # delta sin filtrar
 
-    elif flp == 0  and  fhp > 0:
-        b, a = signal.butter(n, whp, btype="highpass", analog=False, output="ba")
+    # 2. El Butterworth en cascada consigo mismo es un Linkwitz-Riley:
+    #    su respuesta al cuadrado (ver sosfir)
+    return sosfir(sos, m, fs, power=2)
 
-    elif flp > 0  and  fhp > 0:
-        b, a = signal.butter(n, (wlp, whp), btype="bandpass", analog=False, output="ba")
 
+def crossoverbank(fs=44100, m=32768, fc=(), n=4, kind="lr", phase="min",
+                  fnames=None):
+    """
+    Obtiene los FIR de todas las vías de un crossover de len(fc)+1 vías:
+    pasabajos en fc[0], pasabandas entre cortes consecutivos y pasaaltos
+    en fc[-1]. Cada pasabanda es el producto del pasaaltos y el pasabajos
+    de sus cortes, así las vías suman como los filtros de cada corte.
+
+        fs      = Frecuencia de muestreo.
+        m       = Número de muestras de los FIR.
+        fc      = Frecuencias de corte, en orden ascendente.
+        n       = Orden (pendiente) en cada corte, uno para todos o uno por corte.
+        kind    = "lr" Linkwitz-Riley (orden par) o "butter" Butterworth.
+        phase   = "min" la fase propia del filtro IIR (como crossButterworth),
+                  "lin" fase lineal (como crossButterworthLP).
+        fnames  = opcional, archivos .pcm float32 donde guardar cada vía,
+                  uno por vía (len(fc)+1).
+
+    Las respuestas de cada corte se calculan una sola vez sobre una misma
+    rejilla rfft, y todas las vías se llevan al dominio del tiempo con una
+    sola irfft (y una misma ventana para fase lineal).
+
+    Devuelve:
+
+        firs    = array (vías x m)
+        freqs   = frecuencias de la rejilla rfft de m taps
+        Hsum    = respuesta (compleja) de la suma de todas las vías en 'freqs',
+                  para comprobar el resultado.
+    """
+    fc = np.atleast_1d( np.asarray(fc, dtype=float) )
+    n  = np.broadcast_to( n, fc.shape )
+
+    if not len(fc) or np.any( np.diff(fc) <= 0 ):
+        raise ValueError("crossoverbank: fc must be ascending crossover frequencies")
+    if kind not in ("lr", "butter"):
+        raise ValueError("crossoverbank: kind must be 'lr' or 'butter'")
+    if phase not in ("min", "lin"):
+        raise ValueError("crossoverbank: phase must be 'min' or 'lin'")
+    if kind == "lr" and np.any( n % 2 ):
+        raise ValueError("crossoverbank: Linkwitz-Riley order must be even")
+    if fnames is not None and len(fnames) != len(fc) + 1:
+        raise ValueError(f"crossoverbank: fnames must have {len(fc) + 1} file names, one per band")
+
+    # secciones pasabajos y pasaaltos de cada corte
+    power = 2 if kind == "lr" else 1
+    soss  = [ ( buttersos(fs, int(order) // power, flp=f),
+                buttersos(fs, int(order) // power, fhp=f) )
+              for f, order in zip(fc, n) ]
+
+    # rejilla rfft común: para fase mínima lo bastante larga para el corte
+    # que decae más despacio (ver sosfir_len), para fase lineal la de m taps
+    if phase == "min":
+        L = max( sosfir_len(sos, m, power) for pair in soss for sos in pair )
     else:
-        return imp  # delta sin filtrar
+        L = m
+    freqsL = rfftfreqs(L, fs)
 
-    # 2. Aplicamos el Butterwoth a la delta, en cascada para obtener un Linkwitz-Riley
-    imp = signal.lfilter(b, a , imp)
-    imp = signal.lfilter(b, a , imp)
-    return imp
+    # respuestas pasabajos y pasaaltos de cada corte
+    lows  = [ sosresponse(sos_lp, freqsL, fs) ** power for sos_lp, _ in soss ]
+    highs = [ sosresponse(sos_hp, freqsL, fs) ** power for _, sos_hp in soss ]
+
+    # vías: pasabajos, pasabandas, pasaaltos
+    H = np.ones( (len(fc) + 1, len(freqsL)), dtype=complex )
+    H[:-1] *= lows
+    H[1:]  *= highs
+
+    if phase == "min":
+        firs = np.fft.irfft(H, L, axis=-1)[:, :m]
+    else:
+        firs = np.fft.irfft( np.abs(H), m, axis=-1 )
+        firs = np.roll(firs, m // 2, axis=-1) * blackmanharris(m)
+
+    Hsum = np.fft.rfft( firs.sum(axis=0) )
+
+    if fnames:
+        for fir, fname in zip(firs, fnames):
+            # escritura atómica, como tools.savePCM32
+            tmp = f'{fname}.{os.getpid()}.tmp'
+            fir.astype('float32').tofile(tmp)
+            os.replace(tmp, fname)
+
+    return firs, rfftfreqs(m, fs), Hsum
 
 
 def semiblackmanharris(m):
@@ -362,7 +666,7 @@ def semiblackmanharris(m):
     %% m = Número de muestras.
     """
     # generamos la ventana con tamaño 2*m
-    w = signal.blackmanharris(2*m)
+    w = signal.windows.blackmanharris(2*m)
     # devolvemos la mitad derecha
     return w[m:]
 
@@ -371,7 +675,7 @@ def blackmanharris(m):
     """
     %% Obtiene una ventana Blackman-Harris de longitud m.
     """
-    return signal.blackmanharris(m)
+    return signal.windows.blackmanharris(m)
 
 
 def minphsp(sp):
@@ -389,7 +693,62 @@ def minphsp(sp):
     if not sp.ndim == 1:
         raise ValueError("sp must be a vector")
 
-    return np.exp( np.conj( signal.hilbert( np.log(np.abs(sp)) ) ) )
+    # Nota del trad: 'sp' es hermítico (procede de una señal real), así que
+    # se calcula sobre su semiespectro con minphssp, sin signal.hilbert
+    # sobre el espectro completo.
+    n = len(sp)
+    ssp = minphssp( sp[:n//2+1], n=n )
+    return np.concatenate( [ssp, np.conj( ssp[1:(n+1)//2][::-1] )] )
+
+
+def minphssp(ssp, n=None):
+    """
+    Espectro de fase mínima a partir de un SEMIespectro de frecuencias
+    positivas (0 ... m/2, longitud impar), con la misma magnitud que 'ssp'.
+
+    Equivale a minphsp() sobre el espectro completo, pero sin construirlo:
+    el cepstrum real se obtiene con irfft del log de la magnitud, se pliega
+    sobre los tiempos positivos (ventana 1, 2...2, 1, 0...0) y se vuelve
+    con rfft. 'ssp' puede ser un conjunto de semiespectros, uno por fila
+    (se procesa el último eje).
+
+    n:      longitud del espectro completo, por defecto 2*(m-1), o sea 'ssp'
+            incluye Nyquist. Si 'n' es impar, 'ssp' tiene n//2+1 bins.
+
+    (i) El cepstrum de longitud 'n' tiene aliasing temporal si la magnitud
+        varía bruscamente (resonancias, notches). Para limitarlo hace falta
+        un semiespectro más denso: rellenar con ceros el impulso original
+        (ver minphimp) o interpolar la curva con más bins.
+    """
+    m = ssp.shape[-1]
+    if n is None:
+        n = 2 * (m - 1)
+    if m != n // 2 + 1:
+        raise ValueError("minphssp: Spectrum length must be n//2+1")
+
+    # cepstrum real
+    c = np.fft.irfft( np.log(np.abs(ssp)), n, axis=-1 )
+
+    # plegado causal
+    c[..., 1:(n+1)//2] *= 2
+    c[..., n//2+1:] = 0
+
+    return np.exp( np.fft.rfft(c, axis=-1) )
+
+
+def minphimp(imp, pad=2):
+    """
+    Impulso de fase mínima con la misma magnitud que el impulso 'imp'
+    (descarta el exceso de fase, el pico queda al inicio).
+
+    pad:    el impulso se rellena con ceros hasta 'pad' veces su longitud
+            antes de la rfft, para limitar el aliasing temporal del cepstrum
+            (ver minphssp). Se devuelve la misma longitud que 'imp'.
+    """
+    m = imp.shape[-1]
+    n = pad * m
+    ssp = minphssp( np.fft.rfft(imp, n, axis=-1), n=n )
+    return np.fft.irfft(ssp, n, axis=-1)[..., :m]
 
 
 def wholespmp(ssp):
@@ -482,19 +841,19 @@ def lininterp(freq, mag, m, fs):
     newFreq = np.arange(0, m/2+1) * fs / m
 
     # DSD usa la funcion de interpolación de Octave interp1, que es de uso directo.
-    # En Python-Scipy primero se define la función de interpolación, y luego se usa.
+    # Aquí usamos un plan de interpolación (interp_plan) que se calcula una vez
+    # para cada par de vectores de frecuencias, y se guarda para reusarlo.
     #   Eludimos errores si se pidieran valores fuera de rango,
     #   y rellenamos extrapolando si fuera necesario.
     try:
-        I = interpolate.interp1d(freq, mag, kind="quadratic", bounds_error=False,
-                                 fill_value="extrapolate")
+        P = get_plan(freq, newFreq, "quadratic")
     except: # Por si falla quadratic
-        I = interpolate.interp1d(freq, mag, kind="linear", bounds_error=False,
-                                 fill_value="extrapolate")
+        P = get_plan(freq, newFreq, "extrap")
         print( "(pyDSD: error interpolando spline 'quadratic', usando 'linear')" )
 
-    # Obtenemos las magnitudes interpoladas en las 'newFreq':
-    newMag = I(newFreq)
+    # Obtenemos las magnitudes interpoladas en las 'newFreq'
+    # ('mag' puede ser también un conjunto de curvas, una por fila):
+    newMag = P.apply(mag)
 
     return newFreq, newMag
 
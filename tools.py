@@ -6,14 +6,26 @@ import os.path
 import numpy as np
 from scipy.io import wavfile
 from scipy import signal
-from scipy.interpolate import interp1d
 from scipy.fftpack import fftfreq, fft, ifft
+from scipy.fft import next_fast_len
 import yaml
 
 # audiotools imports:
 import pydsd
+from interp_plan import get_plan
+from npcache import array_key, LRUCache, NpzStore
 from q2bw import *
 
+# Min-phase responses already computed, one entry per curve
+# (see min_phase_from_real_mag and set_min_phase_cache_dir)
+MIN_PHASE_CACHE_DIR = os.path.expanduser('~/.cache/audiotools/minphase')
+_min_phases         = LRUCache(maxsize=1024)
+_min_phase_store    = None
+
+# Tamaño de bloque (muestras) de las reducciones por bloques sobre memmap
+# (chunked_peak, chunked_allclose, chunked_energy)
+CHUNK = 2**18
+
 
 def octaves(f1, f2):
     """ octaves from f2 to f1
@@ -73,9 +85,8 @@ def logspaced_gauss( fc=1000, wideOct=10, freq=np.geomspace(20, 20000, 2**10) ):
     # The gaussian itself:
     GaussMag    = signal.windows.gaussian(N, N/sigma)
     # Finally, we render our gaussian curve over the given full freq array
-    Ipol  = interp1d(GaussFreq, GaussMag)   # interpolator
-    Xpol  = extrap1d( Ipol )                # extrapolator
-    wholeGaussMag = Xpol(freq)
+    # (linear interpolation and extrapolation)
+    wholeGaussMag = get_plan(GaussFreq, freq, "extrap").apply(GaussMag)
     return wholeGaussMag
 
 
@@ -208,7 +219,8 @@ def shelf2high(G, wc):
     return num, den
 
 
-def min_phase_from_real_mag(f, sp_real, dB=True, deg=True):
+def min_phase_from_real_mag(f, sp_real, dB=True, deg=True, fs=44100, wsize=None,
+                            tol=1.0):
     """
     Input:
 
@@ -217,11 +229,22 @@ def min_phase_from_real_mag(f, sp_real, dB=True, deg=True):
                         No matter the spectral distribution of the input bins,
                         it works for linear spaced or log spaced flawors,
                         even for arbitrary spaced bins.
+                        'sp_real' can also be a set of curves sharing the
+                        same 'f' bands (curves x bands), all of them are
+                        computed at once.
 
         dB:             Input and output magnitudes given in dB
 
         deg:            Output phase given in deg instead of rad
 
+        fs:             Sampling frequency, the Nyquist of the FFT spectrum
+                        where the min-phase is computed.
+
+        wsize:          FFT size, by default the one from fft_size()
+                        for the lowest 'f' band, 'fs' and 'tol'.
+
+        tol:            Phase error tolerance in degrees, see fft_size()
+
     Output:
 
         f:              Same frecuency bands as input
@@ -230,31 +253,41 @@ def min_phase_from_real_mag(f, sp_real, dB=True, deg=True):
 
         sp_mp_pha:      The computed min-phase phase
 
-    """
-
-    # From dB to linear
-    if dB:
-        sp_real = 10 ** (sp_real / 20.0)
-
-    # From our custom spectrum to a full extended one by using
-    # even spaced bins from 0 Hz to Nyquist.
-    f_ext, sp_real_ext = fft_spectrum(f, sp_real, fs=44100)
+        (same shape as 'sp_real')
 
-    # Obtains the whole minimum phase spectrum
-    # from our real valued specimen.
-    sp_mp = min_phase_wsp( whole_spectrum(sp_real_ext) )
+    (i) Results are memoized curve by curve, keyed by a hash of
+        (f, curve, dB, fs, wsize), so only the curves not seen before
+        are computed (see also set_min_phase_cache_dir).
+    """
+    sp_real = np.asarray(sp_real, dtype=float)
+    if not wsize:
+        wsize = fft_size( np.min(f[f > 0]), fs, tol )
+
+    curves = sp_real.reshape(-1, sp_real.shape[-1])
+    grid   = array_key( np.asarray(f, dtype=float), dB, fs, wsize )
+    keys   = [ array_key(grid, curve) for curve in curves ]
+
+    sp_mp_mag = np.empty( curves.shape )
+    sp_mp_pha = np.empty( curves.shape )
+
+    todo = []
+    for i, key in enumerate(keys):
+        found = _min_phase_lookup(key)
+        if found is None:
+            todo.append(i)
+        else:
+            sp_mp_mag[i], sp_mp_pha[i] = found
 
-    # Getting magnitude and phase from the positive frequencies half
-    # of the obtained minimum phase:
-    N = len(f_ext)
-    sp_mp_mag = np.abs(sp_mp[:N])
-    sp_mp_pha = np.unwrap( np.angle( sp_mp[:N] ) )
+    if todo:
+        mags, phas = _min_phase(f, curves[todo], dB, fs, wsize)
+        sp_mp_mag[todo], sp_mp_pha[todo] = mags, phas
+        for i, mag, pha in zip(todo, mags, phas):
+            _min_phases.put( keys[i], (mag, pha) )
+            if _min_phase_store:
+                _min_phase_store.save( keys[i], mag=mag, pha=pha )
 
-    # Remapping to the original 'f' frequencies
-    I_mag = interp1d(f_ext, sp_mp_mag)
-    I_pha = interp1d(f_ext, sp_mp_pha)
-    sp_mp_mag = I_mag(f)
-    sp_mp_pha = I_pha(f)
+    sp_mp_mag = sp_mp_mag.reshape(sp_real.shape)
+    sp_mp_pha = sp_mp_pha.reshape(sp_real.shape)
 
     # From linear to dB
     if dB:
@@ -267,18 +300,68 @@ def min_phase_from_real_mag(f, sp_real, dB=True, deg=True):
     return f, sp_mp_mag, sp_mp_pha
 
 
+def _min_phase_lookup(key):
+    """ (mag, pha) of a curve already computed, or None
+    """
+    found = _min_phases.get(key)
+    if found is None and _min_phase_store:
+        arrays = _min_phase_store.load(key)
+        if arrays:
+            found = (arrays['mag'], arrays['pha'])
+            _min_phases.put(key, found)
+    return found
+
+
+def set_min_phase_cache_dir(folder=MIN_PHASE_CACHE_DIR, max_bytes=64 * 2**20):
+    """ Enables keeping the min_phase_from_real_mag() results on disk as .npz
+        files under 'folder', limited to 'max_bytes' in total.
+        Use folder=None to disable.
+    """
+    global _min_phase_store
+    _min_phase_store = NpzStore(folder, max_bytes) if folder else None
+
+
+def _min_phase(f, sp_real, dB, fs, wsize):
+    """ the min_phase_from_real_mag() computation for a set of curves,
+        returns the linear magnitudes and the phases in rad
+    """
+    # From dB to linear
+    if dB:
+        sp_real = 10 ** (sp_real / 20.0)
+
+    # From our custom spectrum to a full extended one by using
+    # even spaced bins from 0 Hz to Nyquist.
+    f_ext, sp_real_ext = fft_spectrum(f, sp_real, fs=fs, wsize=wsize)
+
+    # Obtains the minimum phase semi spectrum from our real valued specimen,
+    # (real cepstrum by rfft, for all curves at once along the last axis)
+    sp_mp = pydsd.minphssp( sp_real_ext )
+
+    # Getting magnitude and phase of the obtained minimum phase:
+    sp_mp_mag = np.abs(sp_mp)
+    sp_mp_pha = np.unwrap( np.angle( sp_mp ), axis=-1 )
+
+    # Remapping to the original 'f' frequencies
+    sp_mp_mag, sp_mp_pha = get_plan(f_ext, f).apply( np.stack((sp_mp_mag, sp_mp_pha)) )
+
+    return sp_mp_mag, sp_mp_pha
+
+
 def min_phase_wsp(wsp):
     """
     input:  wps is a whole 'fft' kind of spectrum (real values, linear scaled).
     output: The corresponding minimum phase spectrum (complex values).
 
+    (i) The spectrum is symmetric, so this is computed from its positive
+        half by pydsd.minphssp (rfft), then mirrored.
+
     CREDITS: https://github.com/rripio/DSD
     """
 
     if not wsp.ndim == 1:
         raise ValueError("wsp must be a 1-d array")
 
-    mpwsp =  np.exp( np.conj( signal.hilbert( np.log(wsp) ) ) )
+    mpwsp = pydsd.minphsp(wsp)
 
     return mpwsp
 
@@ -306,6 +389,8 @@ def fft_spectrum(freq, mag, fs=44100, wsize=2**12, make_whole=False):
                     it works for linear spaced or log spaced flawors,
                     even for arbitrary spaced bins.
 
+                    'mag' can also be a set of curves (curves x bands).
+
         fs:         Fs will limit the Nyq of the output spectrum.
 
         wsize:      The window size to compute the output spectrum.
@@ -313,7 +398,8 @@ def fft_spectrum(freq, mag, fs=44100, wsize=2**12, make_whole=False):
                     to a suitable power of 2 value.
 
                     Notice that a useful FFT audio spectrum needs a sufficient
-                    bin resolution, so be careful to use a suitable window size.
+                    bin resolution, so be careful to use a suitable window size
+                    (see fft_size).
 
         make_whole: returns a whole FFT kind of frequencies and magnitude spectrum.
 
@@ -333,13 +419,12 @@ def fft_spectrum(freq, mag, fs=44100, wsize=2**12, make_whole=False):
         print(wsize)
         raise ValueError(f'fft_semi_spectrum wsize must be EVEN')
 
-    I = interp1d(freq, mag)
-    Xtra = extrap1d( I )
-
     ftmp = fftfreq(wsize)
     ftmp = np.concatenate( ([ftmp[0]], -ftmp[wsize//2:][::-1]) )
     freq_new = fs * ftmp
-    mag_new  = Xtra(freq_new)
+
+    # linear interpolation and extrapolation (see interp_plan)
+    mag_new  = get_plan(freq, freq_new, "extrap").apply(mag)
 
     if make_whole:
         freq_new = np.concatenate( (freq_new, np.flipud(freq_new[1:-1]) ) )
@@ -356,14 +441,23 @@ def logspaced_semispectrum(freq, mag, Npoints):
     """
     freqNew  = np.geomspace(1, freq[-1], Npoints)
 
-    funcI = interp1d(   freq,
-                        mag,
-                        kind         = "linear",
-                        bounds_error = False,
-                        fill_value   = "extrapolate"
-                    )
+    return freqNew, get_plan(freq, freqNew, "extrap").apply(mag)
+
+
+def fft_size(fmin, fs, tol=1.0):
+    """ The smallest fast (and even) FFT size to compute the min-phase of a
+        curve whose lowest band is 'fmin', with a phase error below about
+        'tol' degrees (see min_phase_from_real_mag)
 
-    return freqNew, funcI(freqNew)
+        The error comes from the linear spaced FFT bins poorly resolving
+        the low bands, it behaves as 20 * (df / fmin)**2 degrees, where
+        df = fs / N is the bin spacing (measured on the brutefir_eq curves).
+    """
+    df = fmin * np.sqrt(tol / 20.0)
+    N  = next_fast_len( int(np.ceil(fs / df)) )
+    while N % 2:
+        N = next_fast_len(N + 1)
+    return N
 
 
 def nearest_pow2(x):
@@ -390,26 +484,43 @@ def extrap1d(interpolator):
             Xtra  = extrap1d( I )
             Xtra([5, 45])   ----->  array([0.5, 0.5])
 
+        The function is vectorised: the segment of every x point is found
+        with searchsorted, and the points out of range are computed from the
+        first or last segment slope. The interpolator 'y' can be N-D, e.g.
+        a set of curves interpolated at once (same output shape as
+        'interpolator' would give).
     """
     # https://stackoverflow.com/questions/2745329/how-to-make-scipy-interpolate-
     # give-an-extrapolated-result-beyond-the-input-range
 
     xs = interpolator.x
-    ys = interpolator.y
-
-    # linear extrapolation
-    def pointwise(x):
-        # below iso226.FREQS lower limit 20 Hz
-        if x < xs[0]:
-            return ys[0] + (x-xs[0]) * (ys[1]-ys[0]) / (xs[1]-xs[0])
-        # beyond iso226.FREQS upper limit 12.5 KHz
-        elif x > xs[-1]:
-            return ys[-1] + (x-xs[-1]) * (ys[-1]-ys[-2]) / (xs[-1]-xs[-2])
-        else:
-            return interpolator(x)
-
-    def ufunclike(xs):
-        return np.array(list(map(pointwise, np.array(xs))))
+    axis = interpolator.axis
+    ys = np.moveaxis(interpolator.y, axis, -1)
+    linear = getattr(interpolator, '_kind', 'linear') == 'linear'
+
+    def ufunclike(x):
+        x = np.asarray(x, dtype=float)
+
+        # segment index, limited to the first and last segments so that
+        # points below xs[0] or beyond xs[-1] are linearly extrapolated
+        i = np.searchsorted(xs, x, side='right') - 1
+        i = np.clip(i, 0, len(xs) - 2)
+        t = (x - xs[i]) / (xs[i+1] - xs[i])
+        y = ys[..., i] * (1 - t) + ys[..., i+1] * t
+
+        # other kinds than 'linear' are computed by the interpolator itself
+        # inside the xs range
+        if not linear:
+            inside = (x >= xs[0]) & (x <= xs[-1])
+            yi = interpolator( np.clip(x, xs[0], xs[-1]) )
+            yi = np.moveaxis(yi, range(axis, axis + x.ndim),
+                                 range(ys.ndim - 1, ys.ndim - 1 + x.ndim))
+            y = np.where(inside, yi, y)
+
+        # x dimensions where 'interpolator' would place them
+        nlead = ys.ndim - 1
+        return np.moveaxis(y, range(nlead, nlead + x.ndim),
+                              range(axis, axis + x.ndim))
 
     return ufunclike
 
@@ -470,6 +581,23 @@ def read_REW_EQ_txt(rew_eq_fname):
     return PEQs
 
 
+def REW_EQ_sos(PEQs, fs):
+    """
+    Los filtros activos de un diccionario leido con read_REW_EQ_txt()
+    como un banco de biquads 'peakingEQ', array SOS (N, 6).
+
+    Su respuesta se obtiene con pydsd.sosresponse(sos, freqs, fs)
+    """
+    active = [ p for p in PEQs.values() if p['active'] ]
+    if not active:
+        return np.zeros( (0, 6) )
+    return pydsd.biquads( fs,
+                          [p['fc']   for p in active],
+                          [p['Q']    for p in active],
+                          "peakingEQ",
+                          [p['gain'] for p in active] )
+
+
 def MP2LP(imp, windowed=True, kaiserBeta=6):
     """
     audiotools/tools.MP2LP(imp, windowed=True, kaiserBeta=3)
@@ -494,14 +622,16 @@ def MP2LP(imp, windowed=True, kaiserBeta=6):
     # print MP2LP.__doc__
 
     # Obtenemos el espectro completo del impulso dado
+    # (rfft hasta Nyquist y su simétrico)
     Nbins = len(imp)
-    _, h = signal.freqz(imp, worN=Nbins, whole=True)
-    wholemag = np.abs(h)
+    semi = np.abs( np.fft.rfft(imp) )
+    wholemag = np.concatenate( (semi, semi[1 : Nbins - len(semi) + 1][::-1]) )
 
     # Obtenemos el impulso equivalente en linear phase
     return wholemag2LP(wholemag , windowed=windowed, kaiserBeta=kaiserBeta)
 
 
+@pydsd.fircached
 def ba2LP(b, a, m, windowed=True, kaiserBeta=3):
     """
     audiotools/tools.ba2LP(b, a, m, windowed=True, kaiserBeta=4)
@@ -525,6 +655,8 @@ def ba2LP(b, a, m, windowed=True, kaiserBeta=3):
         estrecho. Por contra suaviza los microartifactos de retardo de grupo
         del impulso resultante que son visibles haciendo zoom con 'IR_tool.py'.
         El GD debe ser constante.
+
+    (i) Se guarda en la caché de FIR si se activa con pydsd.set_fir_cache_dir()
     """
     # MUESTRA LA DOC DE ESTA FUNCIÓN:
     # print ba2LP.__doc__
@@ -574,6 +706,41 @@ def wholemag2LP(wholemag, windowed=True, kaiserBeta=3):
         return imp
 
 
+def convolve_firs(firs, mode='full', m=None):
+    """
+    Combina en cadena varios FIR mediante convolución en el dominio rfft:
+    un único tamaño de FFT para todos, producto de los espectros y una irfft.
+
+    firs:   Secuencia de FIRs (arrays o memmap de tools.readPCM)
+
+    mode:   'full'  el FIR resultante completo, sum(len) - N + 1 taps
+
+            'trunc' las primeras 'm' muestras (por defecto el FIR de entrada
+                    más largo) con una semiventana Blackman-Harris, como
+                    hacía FIR_filter.py con lfilter
+    """
+    if mode not in ('full', 'trunc'):
+        raise ValueError("mode must be 'full' or 'trunc'")
+    if not len(firs):
+        raise ValueError('no FIRs to convolve')
+
+    nout = sum( len(fir) for fir in firs ) - len(firs) + 1
+    nfft = next_fast_len(nout, real=True)
+
+    H = np.fft.rfft(firs[0], nfft)
+    for fir in firs[1:]:
+        H *= np.fft.rfft(fir, nfft)
+    imp = np.fft.irfft(H, nfft)[:nout]
+
+    if mode == 'trunc':
+        if m is None:
+            m = max( len(fir) for fir in firs )
+        imp = imp[:m]
+        imp = imp * pydsd.semiblackmanharris(m)[:len(imp)]
+
+    return imp
+
+
 def RoomGain2impulse(imp, fs, gaindB):
     """
     Aplica ecualización Room Gain a un impulso
@@ -591,18 +758,86 @@ def RoomGain2impulse(imp, fs, gaindB):
     return signal.lfilter(b, a, imp)
 
 
+def rfft_response(imp, fs, nfft=None, mask_dB=None):
+    """
+    Respuesta en frecuencia de un FIR con una única rfft:
+
+        freqs   frecuencias de la rejilla rfft de 'nfft' puntos (len(imp) por defecto)
+        magdB   magnitud en dB
+        phase   fase desenrollada en radianes
+        gd      retardo de grupo en muestras
+
+    El GD se obtiene como Re{ FFT(n·h) / H }, sin la evaluación polinómica de
+    signal.group_delay. Es np.nan donde |H| es despreciable (-200 dB respecto
+    del máximo) o donde magdB < 'mask_dB' si se indica.
+    """
+    h = np.asarray(imp, dtype='float64')
+    if nfft is None:
+        nfft = len(h)
+
+    H  = np.fft.rfft(h, nfft)
+    Hn = np.fft.rfft(h * np.arange(len(h)), nfft)
+    freqs = np.fft.rfftfreq(nfft, 1 / fs)
+
+    mag = np.abs(H)
+    with np.errstate(divide='ignore'):
+        magdB = 20 * np.log10(mag)
+    phase = np.unwrap( np.angle(H) )
+
+    valid = mag > mag.max() * 1e-10
+    if mask_dB is not None:
+        valid &= magdB >= mask_dB
+    gd = np.full(len(H), np.nan)
+    gd[valid] = np.real( Hn[valid] / H[valid] )
+
+    return freqs, magdB, phase, gd
+
+
 def maxdB(imp, fs):
     """ busca el máximo en el espectro de un impulso
     """
-    # Obtenemos el espectro 'mag' con cierta resolución 1024 bins
-    Nbins = 1024
-    w, h = signal.freqz(imp, worN=Nbins, whole=False)
-    mag  = np.abs(h)
+    # Obtenemos el espectro con al menos 2048 bins hasta Nyquist
+    freqs, magdB, _, _ = rfft_response( imp, fs, nfft=max(len(imp), 4096) )
     # buscamos el máximo
-    amax = np.amax(mag)             # magnitud máx
-    wmax = w[ np.argmax(mag) ]      # frec máx
-    fmax = wmax * fs/len(imp)
-    return fmax, 20*np.log10(amax)  # frec y mag en dBs
+    i = np.argmax(magdB)
+    return freqs[i], magdB[i]       # frec y mag en dBs
+
+
+def chunked_peak(x, absolute=True, chunk=CHUNK):
+    """ Índice del máximo de 'x' (de abs(x) por defecto), recorriendo
+        'x' por bloques: en un memmap solo se lee un bloque cada vez.
+        Equivale a abs(x).argmax() (o x.argmax() con absolute=False)
+    """
+    ibest, best = 0, -np.inf
+    for i in range(0, len(x), chunk):
+        block = np.asarray(x[i:i+chunk])
+        if absolute:
+            block = np.abs(block)
+        j = block.argmax()
+        if block[j] > best:
+            ibest, best = i + j, block[j]
+    return ibest
+
+
+def chunked_allclose(a, b, rtol=1e-05, atol=1e-08, chunk=CHUNK):
+    """ np.allclose(a, b) por bloques, 'a' y 'b' de la misma longitud,
+        p.ej. vistas de un memmap como imp[:c] e imp[c+1:][::-1]
+    """
+    if len(a) != len(b):
+        raise ValueError(f'lengths differ: {len(a)} {len(b)}')
+    for i in range(0, len(a), chunk):
+        if not np.allclose(a[i:i+chunk], b[i:i+chunk], rtol=rtol, atol=atol):
+            return False
+    return True
+
+
+def chunked_energy(x, chunk=CHUNK):
+    """ Energía sum(x**2) de 'x', en float64 y por bloques
+    """
+    energy = 0.0
+    for i in range(0, len(x), chunk):
+        energy += np.sum( np.square(x[i:i+chunk], dtype='float64') )
+    return energy
 
 
 def isPowerOf2(n):
@@ -768,10 +1003,12 @@ def readPCM32(fname):
 
 
 def savePCM32(raw, fout):
-    # guardamos en raw binary float32
-    f = open(fout, 'wb')
-    raw.astype('float32').tofile(f)
-    f.close()
+    # guardamos en raw binary float32, en un temporal que luego se renombra
+    # para que un lector (o un proceso en paralelo) nunca vea un pcm a medias
+    tmp = f'{fout}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.asarray(raw).astype('float32').tofile(f)
+    os.replace(tmp, fout)
 
 
 def readFRD(fname):
@@ -831,8 +1068,10 @@ def saveFRD(fname, freq, mag, pha=np.array(0), fs=None, comments='', verbose=Tru
         if verbose: print('(saveFRD) phase is zeroed')
         pha = np.zeros(len(mag))
     if verbose: print( f'(saveFRD) saving file: {fname}' )
+    # (i) las frecuencias con más cifras para que no se repitan en
+    #     rejillas densas (p.ej. la rfft de un FIR largo)
     np.savetxt( fname, np.column_stack((freq, mag, pha)),
-             delimiter="\t", fmt='%1.4e', header=header)
+             delimiter="\t", fmt=('%1.8e', '%1.4e', '%1.4e'), header=header)
 
 
 def make_beep(f=1000, fs=48000, dBFS=-9.0, duration=0.10):